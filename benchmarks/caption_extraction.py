@@ -0,0 +1,85 @@
+"""
+Micro-benchmark of caption extraction: links, SKU candidates and ozon mentions of post captions.
+
+Compares the extractor with the caption work of the original client, done the way it ran:
+`find_links` compiling its pattern on every call, one lowercased SKU scan and the ozon check repeated
+for every SKU candidate. The corpus is synthetic, shaped like real captions:
+russian text, emoji, hashtags, marketplace links and article numbers.
+
+Usage:
+    python -m benchmarks.caption_extraction [--captions 5000] [--repeat 5]
+"""
+import argparse
+import random
+import re
+import timeit
+
+from src.parser.clients.extraction import extract_caption
+
+
+TEXT = (
+    'Собрала для вас подборку уютных образов на осень 🍂 Всё нашла на маркетплейсе, качество супер, '
+    'размер в размер. Пишите в комментариях, какой образ понравился больше всего ❤️'
+)
+HASHTAGS = '#осень #образ #wildberries #находкиwb #мода #стиль #ootd'
+TEMPLATES = (
+    '{text}\n\n{hashtags}',
+    '{text}\nАртикул: {sku}\n{hashtags}',
+    '{text}\n1. Пальто — {sku}\n2. Свитер — {sku2}\n3. Ботинки — {sku3}\n{hashtags}',
+    '{text}\nАрт. {sku} на озон 🔥\n{hashtags}',
+    '{text}\nСсылка: https://www.wildberries.ru/catalog/{sku}/detail.aspx?size={size}\n{hashtags}',
+    '{text}\nhttps://www.ozon.ru/product/kurtka-zhenskaya-{sku}/?sh=abc {hashtags}',
+    '{text}\nhttps://l.instagram.com/?u=https%3A%2F%2Fwb.ru%2Fcatalog%2F{sku}&e=AT1 Промокод SALE{size}',
+    '{text} Заказ от 1500 ₽, доставка 2-3 дня, тел. +7 999 123-45-67 {hashtags}',
+)
+
+
+def make_corpus(size: int, seed: int = 42) -> list[str]:
+    rnd = random.Random(seed)
+    return [
+        rnd.choice(TEMPLATES).format(
+            text=TEXT[: rnd.randint(40, len(TEXT))],
+            hashtags=HASHTAGS if rnd.random() < 0.7 else '',
+            sku=rnd.randint(10_000_000, 300_000_000),
+            sku2=rnd.randint(10_000_000, 300_000_000),
+            sku3=rnd.randint(10_000_000, 300_000_000),
+            size=rnd.randint(10_000, 999_999),
+        )
+        for _ in range(size)
+    ]
+
+
+def legacy_find_links(text: str) -> list[str]:
+    url_pattern = re.compile(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+')
+    return url_pattern.findall(text)
+
+
+def legacy_extract(caption: str) -> tuple[list[str], list[str], list[bool]]:
+    # `_process_post` and `_extract_sku_from_caption` of the original client without the WB checks
+    links = legacy_find_links(caption)
+    caption = caption.lower()
+    skus = re.findall(r'\d{5,10}', caption)
+    is_ozon = [any(oz in caption for oz in ('ozon', 'озон')) for _ in skus]
+    return links, skus, is_ozon
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--captions', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.captions)
+    for caption in corpus:
+        features = extract_caption(caption)
+        links, skus, is_ozon = legacy_extract(caption)
+        assert features.links == links and features.skus == [int(sku) for sku in skus], caption
+        assert all(ozon == features.is_ozon for ozon in is_ozon), caption
+
+    for name, func in (('legacy', legacy_extract), ('extractor', extract_caption)):
+        best = min(timeit.repeat(lambda: [func(c) for c in corpus], number=1, repeat=args.repeat))
+        print(f'{name:>12}: {len(corpus) / best:>10,.0f} captions/sec, {best / len(corpus) * 1e6:.2f} us/caption')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Anonymized Instagram API payloads for offline benchmarks.
+
+Payloads keep the structure and field set of real `feed/user`, `feed/reels_media` and
+`users/web_profile_info` answers, while ids, usernames, urls and texts are generated.
+Generation is deterministic, so runs with the same sizes are comparable.
+"""
+import random
+import time
+
+from benchmarks.caption_extraction import make_corpus
+
+
+CDN_URL = 'https://scontent.cdninstagram.com/v/t51.2885-15/{pk}_n.jpg?stp=dst-jpg_e35&_nc_ht=scontent&oh=00_{pk}'
+LINK_STICKERS = (
+    'https://l.instagram.com/?u=https%3A%2F%2Fwww.wildberries.ru%2Fcatalog%2F{sku}%2Fdetail.aspx&e=AT{pk}',
+    'https://l.instagram.com/?u=https%3A%2F%2Fwww.ozon.ru%2Fproduct%2Fplate-{sku}%2F&e=AT{pk}',
+)
+
+
+def _media_versions(rnd: random.Random, pk: int) -> dict:
+    return {
+        'image_versions2': {
+            'candidates': [
+                {'width': width, 'height': width * 16 // 9, 'url': CDN_URL.format(pk=pk)} for width in (1080, 720, 320)
+            ]
+        },
+        'original_width': 1080,
+        'original_height': 1920,
+        'has_audio': rnd.random() < 0.5,
+    }
+
+
+def feed_user(user_id: int, items: int, seed: int = 1) -> dict:
+    """`feed/user/{user_id}` page with `items` posts."""
+    rnd = random.Random(seed)
+    captions = make_corpus(items, seed=seed)
+    now = int(time.time())
+    posts = []
+    for i, caption in enumerate(captions):
+        pk = 3_000_000_000_000_000_000 + seed * 1_000_000 + i
+        posts.append(
+            {
+                'pk': pk,
+                'id': f'{pk}_{user_id}',
+                'code': f'C{pk % 10**10:010d}',
+                'taken_at': now - i * 3600,
+                'media_type': 1,
+                'caption': {'pk': pk + 1, 'text': caption, 'user_id': user_id} if rnd.random() < 0.95 else None,
+                'like_count': rnd.randint(0, 50_000),
+                'comment_count': rnd.randint(0, 2_000),
+                'user': {'pk': user_id, 'username': f'user_{user_id}', 'is_private': False},
+                **_media_versions(rnd, pk),
+            }
+        )
+    return {
+        'items': posts,
+        'num_results': len(posts),
+        'more_available': False,
+        'next_max_id': None,
+        'user': {'pk': user_id, 'username': f'user_{user_id}'},
+        'status': 'ok',
+    }
+
+
+def reels_media(users: int, stories_per_user: int, seed: int = 1) -> dict:
+    """`feed/reels_media` answer for `users` users with `stories_per_user` stories each."""
+    rnd = random.Random(seed)
+    captions = iter(make_corpus(users * stories_per_user, seed=seed))
+    now = int(time.time())
+    reels = {}
+    for u in range(users):
+        user_id = 10_000_000 + seed * 10_000 + u
+        items = []
+        for i in range(stories_per_user):
+            pk = 3_100_000_000_000_000_000 + user_id * 1000 + i
+            caption = next(captions)
+            item = {
+                'pk': pk,
+                'id': f'{pk}_{user_id}',
+                'taken_at': now - i * 600,
+                'media_type': rnd.choice((1, 2)),
+                'accessibility_caption': caption if rnd.random() < 0.6 else None,
+                **_media_versions(rnd, pk),
+            }
+            if item['media_type'] == 2:
+                item['video_versions'] = [{'type': 101, 'url': CDN_URL.format(pk=pk).replace('.jpg', '.mp4')}]
+            if not item['accessibility_caption'] and rnd.random() < 0.5:
+                sticker = rnd.choice(LINK_STICKERS).format(sku=rnd.randint(10_000_000, 300_000_000), pk=pk)
+                item['story_link_stickers'] = [{'story_link': {'url': sticker, 'link_type': 'web'}}]
+            items.append(item)
+        reels[str(user_id)] = {
+            'id': user_id,
+            'items': items,
+            'user': {'pk': user_id, 'username': f'user_{user_id}'},
+        }
+    return {'reels': reels, 'status': 'ok'}
+
+
+def web_profile_info(user_id: int) -> dict:
+    """`users/web_profile_info` answer."""
+    return {
+        'data': {
+            'user': {
+                'id': str(user_id),
+                'username': f'user_{user_id}',
+                'full_name': 'Anonymous',
+                'biography': 'Мода, стиль, находки с маркетплейсов',
+                'edge_followed_by': {'count': 125_000},
+                'edge_follow': {'count': 500},
+                'is_private': False,
+            }
+        },
+        'status': 'ok',
+    }
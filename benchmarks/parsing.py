@@ -0,0 +1,209 @@
+"""
+Offline benchmarks of the parsing layer on anonymized payloads from `benchmarks.fixtures`.
+
+HTTP, db and account pool are stubbed: the client gets decoded fixture payloads, every account request
+returns the same fake account and WB validation confirms every other candidate SKU.
+Each case reports items/sec and, per item, memory blocks and bytes allocated by a run and still alive
+after it (tracemalloc snapshot diff, the result is kept) and the peak of traced memory during the run.
+
+Results can be saved and later runs compared with them:
+    python -m benchmarks.parsing --save baseline.json
+    python -m benchmarks.parsing --compare baseline.json
+
+Usage:
+    python -m benchmarks.parsing [--sizes 10 50 100] [--repeat 5] [--save PATH] [--compare PATH]
+"""
+import argparse
+import asyncio
+import json
+import pathlib
+from types import SimpleNamespace
+import timeit
+import tracemalloc
+
+from benchmarks import fixtures
+from src.db.crud.inst_sku_per_post import build_inst_sku_per_post_values
+from src.db.crud.parser_result import build_result_values
+from src.db.crud.parser_result_posts import build_posts_result_values
+from src.parser.clients import instagram
+from src.parser.clients.extraction import extract_caption
+
+
+ACCOUNT = SimpleNamespace(id=1, proxy=None, cookies='', user_agent='benchmark')
+STORIES_PER_USER = 5
+
+
+def make_client(payload: dict) -> instagram.InstagramClient:
+    client = instagram.InstagramClient()
+
+    async def request(**kwargs):
+        return payload
+
+    async def fetch_account(async_session):
+        return ACCOUNT
+
+    async def check_sku_list(async_session, skus):
+        return {sku: ('brand', sku % 1000) for sku in skus if sku % 2}
+
+    async def resolve(link):
+        return None, None
+
+    client.request = request
+    client._fetch_account = fetch_account
+    client.wildberries.check_sku_list = check_sku_list
+    instagram.redirect_resolver.resolve = resolve
+    return client
+
+
+def measure(name: str, func, items: int, repeat: int) -> dict:
+    func()
+    best = min(timeit.repeat(func, number=1, repeat=repeat))
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    result = func()  # noqa: F841, allocations of the result are part of the cost
+    _, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    # skip the snapshots themselves
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    diff = after.filter_traces(ignore).compare_to(before.filter_traces(ignore), 'filename')
+
+    case = {
+        'name': name,
+        'items': items,
+        'items_per_sec': items / best,
+        'blocks_per_item': sum(stat.count_diff for stat in diff) / items,
+        'bytes_per_item': sum(stat.size_diff for stat in diff) / items,
+        'peak_bytes_per_item': peak / items,
+    }
+    print(
+        f'{name:<40} {items:>6} items {case["items_per_sec"]:>12,.0f} items/sec '
+        f'{case["blocks_per_item"]:>8,.1f} blocks/item {case["bytes_per_item"]:>10,.0f} B/item '
+        f'{case["peak_bytes_per_item"]:>10,.0f} peak B/item'
+    )
+    return case
+
+
+def compare(cases: list[dict], baseline: list[dict]) -> None:
+    """Prints relative change of every case present in the baseline, positive throughput change is faster."""
+    baseline = {case['name']: case for case in baseline}
+    print(f'\n{"compared with baseline":<40} {"items/sec":>10} {"blocks/item":>12} {"B/item":>10} {"peak B/item":>12}')
+    for case in cases:
+        if (base := baseline.get(case['name'])) is None:
+            continue
+        changes = [
+            f'{(case[key] - base[key]) / base[key]:>+{width}.1%}' if base[key] else f'{"n/a":>{width}}'
+            for key, width in (
+                ('items_per_sec', 10),
+                ('blocks_per_item', 12),
+                ('bytes_per_item', 10),
+                ('peak_bytes_per_item', 12),
+            )
+        ]
+        print(f'{case["name"]:<40} ' + ' '.join(changes))
+
+
+def run(sizes: list[int], repeat: int) -> list[dict]:
+    loop = asyncio.new_event_loop()
+    cases = []
+
+    def add(*args):
+        cases.append(measure(*args))
+
+    for size in sizes:
+        feed = fixtures.feed_user(user_id=1, items=size)
+        client = make_client(feed)
+        posts = [client._parse_post(item) for item in feed['items']]
+        features = [extract_caption(post.caption) for post in posts]
+        wb_brands = loop.run_until_complete(client._check_caption_skus(None, features))
+
+        body = json.dumps(feed).encode()
+        add(
+            f'decode {client.json_decoder.name} [feed/user {size}]',
+            lambda: client.json_decoder.decode(body, client.answer_schemas['feed/user']),
+            size,
+            repeat,
+        )
+
+        async def process_posts():
+            return await asyncio.gather(*(client._process_post(p, f, wb_brands) for p, f in zip(posts, features)))
+
+        add(f'_process_post [feed/user {size}]', lambda: loop.run_until_complete(process_posts()), size, repeat)
+
+        def get_posts():
+            # without the watermark of the previous scan every post of the page is new
+            return loop.run_until_complete(client.get_posts_by_id(None, 1))
+
+        add(f'get_posts_by_id [feed/user {size}]', get_posts, size, repeat)
+
+        answer = get_posts()
+        post_ids = {post.post_id: i for i, post in enumerate(answer.posts_list)}
+        rows = len(answer.posts_list) or 1
+        add(f'build_posts_result_values [{size}]', lambda: build_posts_result_values(answer), rows, repeat)
+        add(
+            f'build_inst_sku_per_post_values [{size}]',
+            lambda: build_inst_sku_per_post_values(answer, post_ids),
+            rows,
+            repeat,
+        )
+
+        users = max(size // STORIES_PER_USER, 1)
+        reels = fixtures.reels_media(users=users, stories_per_user=STORIES_PER_USER)
+        client = make_client(reels)
+        items = [item for reel in reels['reels'].values() for item in reel['items']]
+        stories = len(items)
+
+        body = json.dumps(reels).encode()
+        add(
+            f'decode {client.json_decoder.name} [reels {stories}]',
+            lambda: client.json_decoder.decode(body, client.answer_schemas['feed/reels_media']),
+            stories,
+            repeat,
+        )
+
+        add(
+            f'_extract_story_from_item [reels {stories}]',
+            lambda: [client._extract_story_from_item(item) for item in items],
+            stories,
+            repeat,
+        )
+        add(
+            f'get_stories_by_id [reels {stories}]',
+            lambda: loop.run_until_complete(client.get_stories_by_id(None, list(reels['reels']))),
+            stories,
+            repeat,
+        )
+        answers = loop.run_until_complete(client.get_stories_by_id(None, list(reels['reels']))).answers
+        rows = sum(len(answer.stories_list) for answer in answers) or 1
+        add(f'build_result_values [{stories}]', lambda: build_result_values(answers), rows, repeat)
+
+    profile = fixtures.web_profile_info(user_id=1)
+    client = make_client(profile)
+    add(
+        'get_info_by_user_name [web_profile_info]',
+        lambda: loop.run_until_complete(client.get_info_by_user_name(None, 'user_1')),
+        1,
+        repeat,
+    )
+    loop.close()
+    return cases
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 50, 100])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--save', type=pathlib.Path, help='save results as a baseline')
+    parser.add_argument('--compare', type=pathlib.Path, help='compare results with a saved baseline')
+    args = parser.parse_args()
+    cases = run(args.sizes, args.repeat)
+    if args.save:
+        args.save.write_text(json.dumps(cases, indent=2))
+    if args.compare:
+        compare(cases, json.loads(args.compare.read_text()))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 import multiprocessing
 import pathlib
+import socket
 
 from dotenv import load_dotenv
 from pydantic import Field
@@ -17,6 +18,16 @@ class Settings(BaseSettings):
     POSTGRES_HOST: str = Field(default='localhost', env='POSTGRES_HOST')
     POSTGRES_PORT: int = Field(default=5432, env='POSTGRES_PORT')
     POSTGRES_DB: str = Field(default='postgres', env='POSTGRES_DB')
+    # limit of connections of all worker processes, split between processes and their pipelines,
+    # the default fits the default postgres max_connections=100 with room for admin sessions
+    DB_MAX_CONNECTIONS: int = Field(default=90, env='DB_MAX_CONNECTIONS')
+    # upper bound of the pool of one process
+    DB_POOL_SIZE: int = Field(default=50, env='DB_POOL_SIZE')
+    DB_POOL_TIMEOUT_SEC: int = Field(default=30, env='DB_POOL_TIMEOUT_SEC')
+    DB_PGBOUNCER_TRANSACTION_MODE: bool = Field(default=False, env='DB_PGBOUNCER_TRANSACTION_MODE')
+    DB_BUFFER_MAX_ROWS: int = Field(default=1000, env='DB_BUFFER_MAX_ROWS')
+    DB_BUFFER_MAX_DELAY_MS: int = Field(default=500, env='DB_BUFFER_MAX_DELAY_MS')
+    DB_BUFFER_MAX_RETRIES: int = Field(default=3, env='DB_BUFFER_MAX_RETRIES')
 
     #  ------ webdriver settings ---------
     WEBDRIVER: str = Field(default='chrome', env='WEBDRIVER')
@@ -24,7 +35,61 @@ class Settings(BaseSettings):
     #  ------ parser settings ---------
     ACCOUNT_DAILY_USAGE_RATE: int = Field(default=150, env='ACCOUNT_DAILY_USAGE_RATE')
     PROCESS_COUNT: int = Field(default=multiprocessing.cpu_count(), env='PROCESS_COUNT')
+    # worker processes of each pipeline, unset counts share processes left of PROCESS_COUNT
+    IDS_SHARD_COUNT: int | None = Field(default=1, env='IDS_SHARD_COUNT')
+    STORIES_SHARD_COUNT: int | None = Field(default=None, env='STORIES_SHARD_COUNT')
+    POSTS_SHARD_COUNT: int | None = Field(default=None, env='POSTS_SHARD_COUNT')
+    # leases of logins let several parser nodes share one database
+    NODE_ID: str = Field(default=socket.gethostname(), env='NODE_ID')
+    LEASE_DURATION_SEC: int = Field(default=1800, env='LEASE_DURATION_SEC')
     PARSER_BETWEEN_RESTARTS_SLEEP_SEC: int = Field(default=1900, env='PARSER_BETWEEN_RESTARTS_SLEEP_SEC')
+    LOGINS_PAGE_SIZE: int = Field(default=1000, env='LOGINS_PAGE_SIZE')
+    ACCOUNT_POOL_FLUSH_INTERVAL_SEC: int = Field(default=10, env='ACCOUNT_POOL_FLUSH_INTERVAL_SEC')
+    ACCOUNT_POOL_RELOAD_INTERVAL_SEC: int = Field(default=300, env='ACCOUNT_POOL_RELOAD_INTERVAL_SEC')
+    SEEN_STORIES_CACHE_SIZE: int = Field(default=1000000, env='SEEN_STORIES_CACHE_SIZE')
+    WB_SKU_CACHE_SIZE: int = Field(default=100000, env='WB_SKU_CACHE_SIZE')
+    WB_SKU_CACHE_POSITIVE_TTL_SEC: int = Field(default=86400, env='WB_SKU_CACHE_POSITIVE_TTL_SEC')
+    WB_SKU_CACHE_NEGATIVE_TTL_SEC: int = Field(default=3600, env='WB_SKU_CACHE_NEGATIVE_TTL_SEC')
+
+    #  ------ concurrency settings ---------
+    PIPELINE_INITIAL_CONCURRENCY: int = Field(default=3, env='PIPELINE_INITIAL_CONCURRENCY')
+    PIPELINE_MIN_CONCURRENCY: int = Field(default=1, env='PIPELINE_MIN_CONCURRENCY')
+    PIPELINE_MAX_CONCURRENCY: int = Field(default=30, env='PIPELINE_MAX_CONCURRENCY')
+    PROXY_INITIAL_CONCURRENCY: int = Field(default=2, env='PROXY_INITIAL_CONCURRENCY')
+    PROXY_MIN_CONCURRENCY: int = Field(default=1, env='PROXY_MIN_CONCURRENCY')
+    PROXY_MAX_CONCURRENCY: int = Field(default=10, env='PROXY_MAX_CONCURRENCY')
+    CONCURRENCY_LATENCY_THRESHOLD_SEC: int = Field(default=10, env='CONCURRENCY_LATENCY_THRESHOLD_SEC')
+    ACCOUNT_RATE_PER_SEC: float | None = Field(default=None, env='ACCOUNT_RATE_PER_SEC')
+    ACCOUNT_RATE_BURST: int = Field(default=5, env='ACCOUNT_RATE_BURST')
+    PROXY_RATE_PER_SEC: float = Field(default=2, env='PROXY_RATE_PER_SEC')
+    PROXY_RATE_BURST: int = Field(default=5, env='PROXY_RATE_BURST')
+    STORIES_BATCH_INITIAL_SIZE: int = Field(default=30, env='STORIES_BATCH_INITIAL_SIZE')
+    STORIES_BATCH_MIN_SIZE: int = Field(default=5, env='STORIES_BATCH_MIN_SIZE')
+    STORIES_BATCH_MAX_SIZE: int = Field(default=100, env='STORIES_BATCH_MAX_SIZE')
+    STORIES_BATCH_LATENCY_THRESHOLD_SEC: int = Field(default=10, env='STORIES_BATCH_LATENCY_THRESHOLD_SEC')
+    STORIES_BATCH_MAX_ITEMS: int = Field(default=1000, env='STORIES_BATCH_MAX_ITEMS')
+
+    #  ------ http settings ---------
+    HTTP_POOL_LIMIT: int = Field(default=100, env='HTTP_POOL_LIMIT')
+    HTTP_POOL_LIMIT_PER_HOST: int = Field(default=10, env='HTTP_POOL_LIMIT_PER_HOST')
+    HTTP_KEEPALIVE_TIMEOUT_SEC: int = Field(default=60, env='HTTP_KEEPALIVE_TIMEOUT_SEC')
+    HTTP_DNS_CACHE_TTL_SEC: int = Field(default=300, env='HTTP_DNS_CACHE_TTL_SEC')
+    HTTP_MAX_SESSIONS: int = Field(default=1000, env='HTTP_MAX_SESSIONS')
+    REDIRECT_RESOLVER_CONCURRENCY: int = Field(default=10, env='REDIRECT_RESOLVER_CONCURRENCY')
+    REDIRECT_RESOLVER_TIMEOUT_SEC: int = Field(default=15, env='REDIRECT_RESOLVER_TIMEOUT_SEC')
+
+    #  ------ proxy health settings ---------
+    PROXY_HEALTH_WINDOW: int = Field(default=20, env='PROXY_HEALTH_WINDOW')
+    PROXY_HEALTH_MIN_REQUESTS: int = Field(default=5, env='PROXY_HEALTH_MIN_REQUESTS')
+    PROXY_HEALTH_MIN_SUCCESS_RATE: float = Field(default=0.5, env='PROXY_HEALTH_MIN_SUCCESS_RATE')
+    PROXY_HEALTH_SLOW_REQUEST_SEC: int = Field(default=30, env='PROXY_HEALTH_SLOW_REQUEST_SEC')
+    PROXY_HEALTH_SNAPSHOT_TTL_SEC: float = Field(default=1, env='PROXY_HEALTH_SNAPSHOT_TTL_SEC')
+    PROXY_COOLDOWN_SEC: int = Field(default=5, env='PROXY_COOLDOWN_SEC')
+    PROXY_MAX_COOLDOWN_SEC: int = Field(default=900, env='PROXY_MAX_COOLDOWN_SEC')
+
+    #  ------ metrics settings ---------
+    METRICS_PORT: int = Field(default=9100, env='METRICS_PORT')
+    METRICS_FLUSH_INTERVAL_SEC: float = Field(default=5, env='METRICS_FLUSH_INTERVAL_SEC')
 
     class Config:
         env_prefix = ''
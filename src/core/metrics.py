@@ -0,0 +1,197 @@
+from bisect import bisect_left
+from contextlib import asynccontextmanager, contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+
+from src.core.config import settings
+from src.core.logs import custom_logger
+
+
+HTTP_REQUEST_DURATION = 'parser_http_request_duration_seconds'
+DB_QUERY_DURATION = 'parser_db_query_duration_seconds'
+DB_SESSION_WAIT = 'parser_db_session_wait_seconds'
+LIMITER_WAIT = 'parser_limiter_wait_seconds'
+ERRORS = 'parser_errors_total'
+LOGINS_PROCESSED = 'parser_logins_processed_total'
+RESULTS_FOUND = 'parser_results_found_total'
+
+# name -> (type, help)
+DESCRIPTIONS = {
+    HTTP_REQUEST_DURATION: ('histogram', 'Third party API request latency by endpoint.'),
+    DB_QUERY_DURATION: ('histogram', 'Latency of db CRUD functions.'),
+    DB_SESSION_WAIT: ('histogram', 'Time spent waiting for a db session of the pipeline budget.'),
+    LIMITER_WAIT: ('histogram', 'Time spent waiting for a slot of adaptive concurrency limiters.'),
+    ERRORS: ('counter', 'Errors by exception class.'),
+    LOGINS_PROCESSED: ('counter', 'Logins processed by pipeline.'),
+    RESULTS_FOUND: ('counter', 'Stories and posts with SKU found.'),
+}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+Labels = tuple[tuple[str, str], ...]
+
+
+class MetricsRegistry:
+    """
+    Aggregated counters and histograms of all worker processes, rendered in Prometheus text format.
+    Served by `CacheManager`, processes push their local increments with `push`.
+    """
+
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._counters: dict[tuple[str, Labels], float] = {}
+        # bucket counts (the last one is +Inf), sum
+        self._histograms: dict[tuple[str, Labels], tuple[list[int], float]] = {}
+        self._lock = threading.Lock()
+
+    def push(self, counters: dict, histograms: dict) -> None:
+        with self._lock:
+            for key, value in counters.items():
+                self._counters[key] = self._counters.get(key, 0) + value
+            for key, (counts, total) in histograms.items():
+                current_counts, current_total = self._histograms.get(key, ([0] * len(counts), 0.0))
+                self._histograms[key] = ([a + b for a, b in zip(current_counts, counts)], current_total + total)
+
+    def render(self) -> str:
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = dict(self._histograms)
+
+        lines = []
+        for name in sorted({name for name, _ in counters} | {name for name, _ in histograms}):
+            metric_type, description = DESCRIPTIONS.get(name, ('untyped', ''))
+            lines += [f'# HELP {name} {description}', f'# TYPE {name} {metric_type}']
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{self._format_labels(labels)} {value}')
+            for (metric, labels), (counts, total) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for le, count in zip((*self.buckets, '+Inf'), counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{self._format_labels(labels + (("le", str(le)),))} {cumulative}')
+                lines.append(f'{name}_sum{self._format_labels(labels)} {total}')
+                lines.append(f'{name}_count{self._format_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _format_labels(labels: Labels) -> str:
+        if not labels:
+            return ''
+        values = ','.join(f'{key}="{str(value).replace(chr(34), chr(39))}"' for key, value in labels)
+        return '{' + values + '}'
+
+
+class Metrics:
+    """
+    Process-local collector, increments are accumulated and pushed to the registry every `flush_interval_sec`.
+    """
+
+    def __init__(
+        self,
+        registry: MetricsRegistry = None,
+        flush_interval_sec: float = settings.METRICS_FLUSH_INTERVAL_SEC,
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        self.registry = registry if registry is not None else MetricsRegistry(buckets)
+        self.flush_interval_sec = flush_interval_sec
+        self.buckets = buckets
+        self._counters: dict[tuple[str, Labels], float] = {}
+        self._histograms: dict[tuple[str, Labels], tuple[list[int], float]] = {}
+        self._flushed_at = time.monotonic()
+
+    def attach(self, registry: MetricsRegistry) -> None:
+        """Push to a registry shared with other processes."""
+        self.registry = registry
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        self._counters[key] = self._counters.get(key, 0) + value
+        self._flush_if_outdated()
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        counts, total = self._histograms.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+        counts[bisect_left(self.buckets, value)] += 1
+        self._histograms[key] = (counts, total + value)
+        self._flush_if_outdated()
+
+    @asynccontextmanager
+    async def timer(self, name: str, **labels):
+        started_at = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - started_at, **labels)
+
+    @contextmanager
+    def count_errors(self):
+        """Counts exceptions raised by the wrapped block by class and re-raises them."""
+        try:
+            yield
+        except Exception as ex:
+            self.count_error(ex)
+            raise
+
+    def count_error(self, ex: Exception) -> None:
+        """Counts an exception handled without re-raising, so no outer `count_errors` sees it."""
+        self.inc(ERRORS, exception=type(ex).__name__)
+
+    def timed(self, name: str):
+        """Decorator of coroutine functions, observes their duration labeled by function name."""
+
+        def decorator(func):
+            @wraps(func)
+            async def wrapper(*args, **kwargs):
+                async with self.timer(name, function=func.__name__):
+                    return await func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def flush(self) -> None:
+        counters, self._counters = self._counters, {}
+        histograms, self._histograms = self._histograms, {}
+        self._flushed_at = time.monotonic()
+        if not counters and not histograms:
+            return
+        try:
+            self.registry.push(counters, histograms)
+        except (OSError, EOFError) as ex:
+            # manager process is gone, e.g. during shutdown
+            custom_logger.error(f'Cannot push metrics ({type(ex)}): {ex}')
+
+    def _flush_if_outdated(self) -> None:
+        if time.monotonic() - self._flushed_at >= self.flush_interval_sec:
+            self.flush()
+
+
+def start_metrics_server(registry: MetricsRegistry, port: int = settings.METRICS_PORT) -> ThreadingHTTPServer:
+    """Serves `registry` on http://0.0.0.0:{port}/metrics from a daemon thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):  # noqa: N802
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), Handler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    custom_logger.info(f'Metrics are served on port {port}')
+    return server
+
+
+metrics = Metrics()
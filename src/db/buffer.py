@@ -0,0 +1,202 @@
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+import time
+from typing import Callable
+
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.core.config import settings
+from src.core.logs import custom_logger
+from src.core.metrics import DB_QUERY_DURATION, metrics
+from src.db.crud.inst_sku_per_post import build_inst_sku_per_post_values, insert_inst_sku_per_post_values
+from src.db.crud.instagram_logins import build_login_values
+from src.db.crud.parser_result import build_result_values, insert_result_values
+from src.db.crud.parser_result_posts import build_posts_result_values, upsert_posts_result_values
+from src.db.exceptions import BufferFlushError
+from src.db.models import InstagramLogins
+from src.parser.clients.models import InstagramClientAnswer
+
+
+@dataclass(slots=True)
+class BufferedEntry:
+    """Rows of one add call, they are written or dropped together."""
+
+    results: list[dict]
+    posts: list[InstagramClientAnswer]
+    logins: list[dict]
+    rows_count: int
+    # called once the rows are committed
+    on_flush: Callable[[], None] | None = None
+
+
+class WriteBehindBuffer:
+    """
+    Collects parser results and login updates of a worker process and writes them in one transaction
+    once `max_rows` rows are buffered or the oldest row is `max_delay_ms` old.
+    Logins are acknowledged in the same transaction as their results, `close` flushes the rest on shutdown.
+    """
+
+    def __init__(
+        self,
+        max_rows: int = settings.DB_BUFFER_MAX_ROWS,
+        max_delay_ms: int = settings.DB_BUFFER_MAX_DELAY_MS,
+        max_retries: int = settings.DB_BUFFER_MAX_RETRIES,
+    ):
+        self.max_rows = max_rows
+        self.max_delay_sec = max_delay_ms / 1000
+        self.max_retries = max_retries
+        self._entries: list[BufferedEntry] = []
+        self._rows_count = 0
+        self._buffered_at: float | None = None
+        self._lock = asyncio.Lock()
+        self._flush_task: asyncio.Task | None = None
+        self._async_session: AsyncSession | None = None
+
+    async def add_stories(
+        self,
+        async_session: AsyncSession,
+        result_list: list[InstagramClientAnswer],
+        login_list: list[InstagramLogins],
+        on_flush: Callable[[], None] = None,
+    ) -> None:
+        results = build_result_values(result_list)
+        # pipelines acknowledge logins by their own update times
+        logins = build_login_values(login_list, columns=('updated_at',))
+        await self._added(
+            async_session, BufferedEntry(results, [], logins, len(results) + len(logins), on_flush=on_flush)
+        )
+
+    async def add_posts(
+        self, async_session: AsyncSession, result: InstagramClientAnswer, login: InstagramLogins
+    ) -> None:
+        logins = build_login_values([login], columns=('posts_updated_at', 'newest_post_id'))
+        # post and its SKUs
+        await self._added(async_session, BufferedEntry([], [result], logins, 2 * len(result.posts_list) + 1))
+
+    async def flush(self) -> None:
+        """
+        Writes buffered rows, a failed write is retried up to `max_retries` times.
+        Then the batch is split in halves until the failing entries are isolated,
+        they are dropped and reported by `BufferFlushError` once the rest is written.
+        """
+        async with self._lock:
+            entries, self._entries = self._entries, []
+            self._rows_count = 0
+            self._buffered_at = None
+            if not entries:
+                return
+            written, dropped = await self._write_with_retries(entries)
+
+        for entry in written:
+            if entry.on_flush:
+                entry.on_flush()
+        if dropped:
+            raise BufferFlushError(sum(entry.rows_count for entry in dropped), len(dropped))
+
+    async def close(self) -> None:
+        if self._flush_task:
+            self._flush_task.cancel()
+            self._flush_task = None
+        try:
+            await self.flush()
+        except BufferFlushError as ex:
+            metrics.count_error(ex)
+            custom_logger.error(ex)
+
+    async def _write_with_retries(
+        self, entries: list[BufferedEntry]
+    ) -> tuple[list[BufferedEntry], list[BufferedEntry]]:
+        rows_count = sum(entry.rows_count for entry in entries)
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                await asyncio.sleep(self.max_delay_sec * attempt)
+            try:
+                await self._write(entries)
+                return entries, []
+            except Exception as ex:  # noqa: PIE786
+                error = ex
+                custom_logger.error(
+                    f'Cannot flush {rows_count} buffered rows, attempt {attempt + 1} ({type(ex)}): {ex}'
+                )
+        return await self._write_split(entries, error)
+
+    async def _write_split(
+        self, entries: list[BufferedEntry], error: Exception
+    ) -> tuple[list[BufferedEntry], list[BufferedEntry]]:
+        """Writes halves of a failed batch separately until the failing entries are isolated."""
+        written, dropped = [], []
+        failed = deque([(entries, error)])
+        while failed:
+            batch, error = failed.popleft()
+            if len(batch) == 1:
+                custom_logger.error(f'{batch[0].rows_count} buffered rows dropped ({type(error)}): {error}')
+                dropped.extend(batch)
+                continue
+            middle = len(batch) // 2
+            for half in (batch[:middle], batch[middle:]):
+                try:
+                    await self._write(half)
+                    written.extend(half)
+                except Exception as ex:  # noqa: PIE786
+                    failed.append((half, ex))
+        return written, dropped
+
+    async def _write(self, entries: list[BufferedEntry]) -> None:
+        results = [row for entry in entries for row in entry.results]
+        posts = [post for entry in entries for post in entry.posts]
+        # login id -> updated column values, the latest update wins
+        logins = {}
+        for entry in entries:
+            for values in entry.logins:
+                logins.setdefault(values['id'], {}).update(values)
+
+        async with metrics.timer(DB_QUERY_DURATION, function='write_buffer'), self._async_session() as s:
+            if results:
+                await insert_result_values(s, results)
+
+            # dedupe by post_id across answers, the last occurrence wins
+            posts_values = {row['post_id']: row for post in posts for row in build_posts_result_values(post)}
+            posts_values = list(posts_values.values())
+            if posts_values:
+                post_id_to_id_mapping = await upsert_posts_result_values(s, posts_values)
+                await insert_inst_sku_per_post_values(
+                    s, [row for post in posts for row in build_inst_sku_per_post_values(post, post_id_to_id_mapping)]
+                )
+
+            if logins:
+                await s.execute(update(InstagramLogins), list(logins.values()))
+            await s.commit()
+
+    async def _added(self, async_session: AsyncSession, entry: BufferedEntry) -> None:
+        self._async_session = async_session
+        self._entries.append(entry)
+        self._rows_count += entry.rows_count
+        if self._buffered_at is None:
+            self._buffered_at = time.monotonic()
+        self._start_flushing()
+        if self._rows_count >= self.max_rows:
+            await self.flush()
+
+    def _start_flushing(self) -> None:
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_periodically())
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            if self._buffered_at is None:
+                await asyncio.sleep(self.max_delay_sec)
+                continue
+            if (wait := self._buffered_at + self.max_delay_sec - time.monotonic()) > 0:
+                await asyncio.sleep(wait)
+                continue
+            try:
+                await self.flush()
+            except BufferFlushError as ex:
+                # nobody waits for this flush, the error is only reported
+                metrics.count_error(ex)
+                custom_logger.error(ex)
+
+
+write_buffer = WriteBehindBuffer()
@@ -1,6 +1,15 @@
+import asyncio
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+import time
+from uuid import uuid4
+
 from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncEngine, create_async_engine
+from sqlalchemy.pool import NullPool
 
 from src.core.config import settings
+from src.core.logs import custom_logger
+from src.core.metrics import DB_SESSION_WAIT, metrics
 
 
 DATABASE_URL = (
@@ -8,10 +17,114 @@ DATABASE_URL = (
     f'@{settings.POSTGRES_HOST}:{settings.POSTGRES_PORT}/{settings.POSTGRES_DB}'
 )
 
+# pipeline of the current task, sessions opened outside of pipelines are not limited by budget
+current_pipeline: ContextVar[str | None] = ContextVar('current_pipeline', default=None)
+
+
+class ConnectionBudget:
+    """
+    Pool size of a worker process and its split between the pipelines of the process.
+    `max_connections` of all processes is split evenly between them, a process gets at most `pool_size`.
+    """
 
-def get_db_pool():
-    return create_async_engine(DATABASE_URL, connect_args={'timeout': 30}, pool_size=50, max_overflow=0)
+    def __init__(
+        self,
+        process_count: int = 1,
+        pipelines: tuple[str, ...] = (),
+        pool_size: int = settings.DB_POOL_SIZE,
+        max_connections: int = settings.DB_MAX_CONNECTIONS,
+    ):
+        process_count = max(1, process_count)
+        if process_count > max_connections:
+            custom_logger.warning(
+                f'{process_count} processes need at least one connection each, '
+                f'DB_MAX_CONNECTIONS={max_connections} is exceeded'
+            )
+        self.pool_size = max(1, min(pool_size, max_connections // process_count))
+        self.pipeline_limits = {pipeline: max(1, self.pool_size // len(pipelines)) for pipeline in pipelines}
+
+
+def get_db_pool(budget: ConnectionBudget = None):
+    budget = budget or ConnectionBudget()
+    connect_args = {'timeout': 30}
+    url = DATABASE_URL
+    if settings.DB_PGBOUNCER_TRANSACTION_MODE:
+        # pgbouncer pools connections itself and server side prepared statements
+        # do not survive between transactions, so pipeline limits are the only budget here
+        return create_async_engine(
+            url + '?prepared_statement_cache_size=0',
+            connect_args=connect_args
+            | {'statement_cache_size': 0, 'prepared_statement_name_func': lambda: f'__asyncpg_{uuid4()}__'},
+            poolclass=NullPool,
+        )
+    return create_async_engine(
+        url,
+        connect_args=connect_args,
+        pool_size=budget.pool_size,
+        max_overflow=0,
+        pool_timeout=settings.DB_POOL_TIMEOUT_SEC,
+    )
 
 
 def get_async_sessionmaker(engine: AsyncEngine):
     return async_sessionmaker(engine, expire_on_commit=False)
+
+
+class BudgetedSessionMaker:
+    """
+    Session maker that limits sessions opened concurrently by each pipeline to its share of the pool.
+    Collects wait time and pool saturation stats.
+    """
+
+    def __init__(self, engine: AsyncEngine, budget: ConnectionBudget):
+        self.engine = engine
+        self.budget = budget
+        self._sessionmaker = get_async_sessionmaker(engine)
+        self._semaphores = {pipeline: asyncio.Semaphore(limit) for pipeline, limit in budget.pipeline_limits.items()}
+        self._wait_time_sec = dict.fromkeys(budget.pipeline_limits, 0.0)
+        self._max_wait_time_sec = dict.fromkeys(budget.pipeline_limits, 0.0)
+        self._sessions_count = dict.fromkeys(budget.pipeline_limits, 0)
+        self._in_use = dict.fromkeys(budget.pipeline_limits, 0)
+
+    @asynccontextmanager
+    async def __call__(self):
+        if (semaphore := self._semaphores.get(pipeline := current_pipeline.get())) is None:
+            async with self._sessionmaker() as session:
+                yield session
+            return
+
+        started_at = time.monotonic()
+        async with semaphore:
+            wait_time = time.monotonic() - started_at
+            self._wait_time_sec[pipeline] += wait_time
+            self._max_wait_time_sec[pipeline] = max(self._max_wait_time_sec[pipeline], wait_time)
+            metrics.observe(DB_SESSION_WAIT, wait_time, pipeline=pipeline)
+            self._sessions_count[pipeline] += 1
+            self._in_use[pipeline] += 1
+            try:
+                async with self._sessionmaker() as session:
+                    yield session
+            finally:
+                self._in_use[pipeline] -= 1
+
+    def stats(self) -> dict:
+        pool = self.engine.pool
+        pool_stats = {}
+        if not isinstance(pool, NullPool):
+            pool_stats = {
+                'pool_size': pool.size(),
+                'checked_out': pool.checkedout(),
+                'saturation': pool.checkedout() / pool.size(),
+            }
+        return pool_stats | {
+            'pipelines': {
+                pipeline: {
+                    'limit': limit,
+                    'in_use': self._in_use[pipeline],
+                    'sessions': self._sessions_count[pipeline],
+                    'avg_wait_sec': self._wait_time_sec[pipeline] / max(1, self._sessions_count[pipeline]),
+                    'max_wait_sec': self._max_wait_time_sec[pipeline],
+                }
+                for pipeline, limit in self.budget.pipeline_limits.items()
+            },
+        }
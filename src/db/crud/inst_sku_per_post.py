@@ -1,26 +1,42 @@
 from sqlalchemy.dialects.postgresql import insert
 
-from src.db.models import InstSkuPerPost, ParserResultPost
+from src.core.metrics import DB_QUERY_DURATION, metrics
+from src.db.models import InstSkuPerPost
 from src.parser.clients.models import InstagramClientAnswer
 
 
-async def add_inst_sku_per_post_list(session, result: InstagramClientAnswer, result_post_db: list[ParserResultPost]) -> None:
+# keeps statement parameters count (5 per row) below postgres limit
+INSERT_CHUNK_SIZE = 1000
+
+
+def build_inst_sku_per_post_values(result: InstagramClientAnswer, post_id_to_id_mapping: dict[int, int]) -> list[dict]:
+    return [
+        {
+            'parser_result_post_id': post_id_to_id_mapping[post.post_id],
+            'marketplace': post.marketplace.value,
+            'sku': int(post.sku),
+            'brand': post.brand,
+            'brand_id': post.brand_id,
+        }
+        for post in result.posts_list
+    ]
+
+
+async def insert_inst_sku_per_post_values(s, db_values_list: list[dict]) -> None:
+    """Insert rows within the transaction of `s`, one multi-row statement per chunk."""
+    for i in range(0, len(db_values_list), INSERT_CHUNK_SIZE):
+        await s.execute(
+            insert(InstSkuPerPost).values(db_values_list[i: i + INSERT_CHUNK_SIZE]).on_conflict_do_nothing()
+        )
+
+
+@metrics.timed(DB_QUERY_DURATION)
+async def add_inst_sku_per_post_list(
+    session, result: InstagramClientAnswer, post_id_to_id_mapping: dict[int, int]
+) -> None:
     async with session() as s:
-        db_values_list = []
-        post_id_to_id_mapping = {p.post_id: p.id for p in result_post_db}
-        if result.posts_list:
-            for post in result.posts_list:
-                db_values_list.append(
-                    {
-                        'parser_result_post_id': post_id_to_id_mapping[post.post_id],
-                        'marketplace': post.marketplace.value,
-                        'sku': int(post.sku),
-                        'brand': post.brand,
-                        'brand_id': post.brand_id,
-                    }
-                )
+        db_values_list = build_inst_sku_per_post_values(result, post_id_to_id_mapping)
 
         if db_values_list:
-            # If using PostgreSQL, consider on_conflict_do_nothing for ignoring conflicts.
-            await s.execute(insert(InstSkuPerPost).values(db_values_list).on_conflict_do_nothing())
+            await insert_inst_sku_per_post_values(s, db_values_list)
             await s.commit()
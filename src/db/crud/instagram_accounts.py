@@ -2,14 +2,26 @@ from datetime import datetime, timedelta
 import random
 
 import pytz
-from sqlalchemy import select, update
+from sqlalchemy import bindparam, or_, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.core.config import settings
 from src.core.logs import custom_logger
+from src.core.metrics import DB_QUERY_DURATION, metrics
 from src.db.crud.proxies import get_proxy_all, ProxyTypes
 from src.db.exceptions import NoAccountsDBError, NoProxyDBError
-from src.db.models import InstagramAccounts
+from src.db.models import InstagramAccounts, UsageReset
+
+
+USAGE_RESET_WINDOW = timedelta(days=1)
+# window known to be reset, saves db round trips within the window
+_last_reset_window_start: datetime | None = None
+
+
+def get_usage_window_start(now: datetime = None, window: timedelta = USAGE_RESET_WINDOW) -> datetime:
+    """Start of the usage window (aligned to unix epoch in UTC) that contains `now`."""
+    now = now or datetime.now(pytz.utc)
+    return now - (now - datetime(1970, 1, 1, tzinfo=pytz.utc)) % window
 
 
 async def get_accounts_all(session: AsyncSession) -> list[InstagramAccounts]:
@@ -22,6 +34,46 @@ async def get_accounts_without_proxy(session: AsyncSession) -> list[InstagramAcc
     return result.scalars().all()
 
 
+@metrics.timed(DB_QUERY_DURATION)
+async def get_accounts_for_usage(session: AsyncSession) -> list[InstagramAccounts]:
+    result = await session.execute(
+        select(InstagramAccounts)
+        .filter(InstagramAccounts.proxy != None, InstagramAccounts.daily_usage_rate < settings.ACCOUNT_DAILY_USAGE_RATE)
+        .order_by(InstagramAccounts.last_used_at.asc().nulls_first())
+    )
+    return result.scalars().all()
+
+
+@metrics.timed(DB_QUERY_DURATION)
+async def update_accounts_usage(session: AsyncSession, usage_list: list[dict]) -> None:
+    """
+    Write back usage counters collected in memory.
+    Each item has keys: account_id, delta, used_at and reset (counter was reset before delta was collected).
+    """
+    table = InstagramAccounts.__table__
+    increments = [
+        {'account_id': u['account_id'], 'delta': u['delta'], 'used_at': u['used_at']} for u in usage_list if not u['reset']
+    ]
+    resets = [
+        {'account_id': u['account_id'], 'delta': u['delta'], 'used_at': u['used_at']} for u in usage_list if u['reset']
+    ]
+    if increments:
+        await session.execute(
+            update(table)
+            .where(table.c.id == bindparam('account_id'))
+            .values(daily_usage_rate=table.c.daily_usage_rate + bindparam('delta'), last_used_at=bindparam('used_at')),
+            increments,
+        )
+    if resets:
+        await session.execute(
+            update(table)
+            .where(table.c.id == bindparam('account_id'))
+            .values(daily_usage_rate=bindparam('delta'), last_used_at=bindparam('used_at')),
+            resets,
+        )
+    await session.commit()
+
+
 async def get_account(session: AsyncSession) -> InstagramAccounts:
     query = select(InstagramAccounts).filter(
         InstagramAccounts.proxy != None, InstagramAccounts.daily_usage_rate < settings.ACCOUNT_DAILY_USAGE_RATE
@@ -40,7 +92,7 @@ async def get_account(session: AsyncSession) -> InstagramAccounts:
     account = random.choice(account_list)
 
     # Logic for updating the selected account
-    if account.last_used_at and (datetime.now(pytz.utc) - account.last_used_at) >= timedelta(days=1):
+    if account.last_used_at and account.last_used_at < get_usage_window_start():
         await session.execute(
             update(InstagramAccounts)
             .where(InstagramAccounts.credentials == account.credentials)
@@ -56,22 +108,45 @@ async def get_account(session: AsyncSession) -> InstagramAccounts:
     return account
 
 
-async def update_accounts_daily_usage_rate(session: AsyncSession) -> None:
-        accounts = await get_accounts_all(session)
-        for acc in accounts:
-            if acc.last_used_at and (datetime.now(pytz.utc) - acc.last_used_at).days >= 1:
-                await session.execute(
-                    update(InstagramAccounts)
-                    .where(InstagramAccounts.credentials == acc.credentials)
-                    .values(daily_usage_rate=0)
-                )
-            elif acc.daily_usage_rate > 0:
-                await session.execute(
-                    update(InstagramAccounts)
-                    .where(InstagramAccounts.credentials == acc.credentials)
-                    .values(daily_usage_rate=0)
-                )
-        await session.commit()
+@metrics.timed(DB_QUERY_DURATION)
+async def update_accounts_daily_usage_rate(session: AsyncSession, window: timedelta = USAGE_RESET_WINDOW) -> int:
+    """
+    Reset usage counters of accounts that were not used since the current usage window started.
+    The window is claimed in `usage_reset` with a conditional update, so the reset runs once per window
+    across processes, nodes and restarts: concurrent claims wait for the row lock and find the window taken.
+
+    Returns:
+        int: number of accounts reset.
+    """
+    global _last_reset_window_start
+
+    window_start = get_usage_window_start(window=window)
+    if _last_reset_window_start == window_start:
+        return 0
+
+    claimed = await session.scalar(
+        update(UsageReset)
+        .where(UsageReset.window_start < window_start)
+        .values(window_start=window_start)
+        .returning(UsageReset.id)
+    )
+    if claimed is None:
+        await session.rollback()
+        _last_reset_window_start = window_start
+        return 0
+
+    result = await session.execute(
+        update(InstagramAccounts)
+        .where(
+            InstagramAccounts.daily_usage_rate > 0,
+            or_(InstagramAccounts.last_used_at == None, InstagramAccounts.last_used_at < window_start),
+        )
+        .values(daily_usage_rate=0)
+        .execution_options(synchronize_session=False)
+    )
+    await session.commit()
+    _last_reset_window_start = window_start
+    return result.rowcount
 
 
 async def set_proxy_for_accounts(session: AsyncSession, accounts: list[InstagramAccounts]) -> None:
@@ -84,6 +159,7 @@ async def set_proxy_for_accounts(session: AsyncSession, accounts: list[Instagram
     await session.commit()
 
 
+@metrics.timed(DB_QUERY_DURATION)
 async def delete_account(session: AsyncSession, account: InstagramAccounts) -> None:
     await session.delete(account)
     await session.commit()
@@ -1,69 +1,323 @@
 from datetime import datetime, timedelta
+from typing import AsyncIterator
 
-from sqlalchemy import select, update, delete
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    ColumnElement,
+    Integer,
+    MetaData,
+    Select,
+    String,
+    Table,
+    cast,
+    delete,
+    exists,
+    func,
+    insert,
+    literal,
+    or_,
+    select,
+    tuple_,
+    update,
+)
+from sqlalchemy.dialects.postgresql import BIT, TIMESTAMP
+from sqlalchemy.orm import InstrumentedAttribute
+from sqlalchemy.schema import CreateTable
 
+from src.core.config import settings
+from src.core.metrics import DB_QUERY_DURATION, metrics
 from src.db.models import InstagramLogins
 
 
-async def update_login(session, new_login_data: InstagramLogins) -> None:
-    stmt = select(InstagramLogins).where(InstagramLogins.user_id == new_login_data.user_id)
-    old = await session.execute(stmt)
-    old = old.first()
-    if old:
-        await session.execute(delete(InstagramLogins).where(InstagramLogins.id == new_login_data.id))
-        await session.commit()
-        return
-    await session.execute(
-        update(InstagramLogins)
-        .where(InstagramLogins.username == new_login_data.username)
-        .values(
-            user_id=new_login_data.user_id,
-            followers=new_login_data.followers,
-            is_exists=True,
-            updated_at=new_login_data.updated_at,
-            posts_updated_at=new_login_data.posts_updated_at,
-        )
-    )
-    await session.commit()
+# update time column of pipelines -> lease columns of their logins
+# ids and stories pipelines never select the same login (see `has_user_id`), so they share one lease
+LEASE_COLUMNS = {
+    'updated_at': ('lease_until', 'lease_owner'),
+    'posts_updated_at': ('posts_lease_until', 'posts_lease_owner'),
+}
+
+
+def lease_columns(
+    updated_at_column: InstrumentedAttribute = InstagramLogins.updated_at,
+) -> tuple[InstrumentedAttribute, InstrumentedAttribute]:
+    """Lease until and lease owner columns of pipelines acknowledging logins by `updated_at_column`."""
+    until, owner = LEASE_COLUMNS[updated_at_column.key]
+    return getattr(InstagramLogins, until), getattr(InstagramLogins, owner)
+
+
+# staging table for resolved user ids, lives until the end of transaction
+new_login_ids_table = Table(
+    'tmp_new_login_ids',
+    MetaData(),
+    Column('username', String(255)),
+    Column('user_id', BigInteger),
+    Column('followers', BigInteger),
+    Column('posts_updated_at', TIMESTAMP(timezone=True)),
+    prefixes=['TEMPORARY'],
+    postgresql_on_commit='DROP',
+)
 
 
+@metrics.timed(DB_QUERY_DURATION)
 async def update_new_login_ids(session, login_list: list[InstagramLogins]) -> None:
+    """
+    Store resolved user ids in one transaction.
+    Logins whose user id already belongs to another login (or to another login of the same batch)
+    are deleted, the rest get their user ids and followers.
+    """
+    if not login_list:
+        return
+
+    now = datetime.now()
+    logins = InstagramLogins.__table__
+    tmp = new_login_ids_table
     async with session() as s:
-        for login in login_list:
-            login.updated_at = datetime.now()
-            await update_login(s, login)
+        await s.execute(CreateTable(tmp))
+        await s.execute(
+            insert(tmp),
+            [
+                {
+                    'username': login.username,
+                    'user_id': login.user_id,
+                    'followers': login.followers,
+                    'posts_updated_at': login.posts_updated_at,
+                }
+                for login in login_list
+            ],
+        )
+
+        # user id is already taken by another login
+        other = logins.alias('other')
+        await s.execute(
+            delete(logins).where(
+                logins.c.username == tmp.c.username,
+                exists().where(other.c.user_id == tmp.c.user_id, other.c.username != tmp.c.username),
+            )
+        )
+
+        # several logins of the batch resolved to the same user id, only one of them is kept
+        winners = select(tmp).distinct(tmp.c.user_id).order_by(tmp.c.user_id, tmp.c.username).subquery()
+        await s.execute(
+            delete(logins).where(
+                logins.c.username.in_(select(tmp.c.username)),
+                logins.c.username.not_in(select(winners.c.username)),
+            )
+        )
+
+        await s.execute(
+            update(logins)
+            .where(logins.c.username == winners.c.username)
+            .values(
+                user_id=winners.c.user_id,
+                followers=winners.c.followers,
+                is_exists=True,
+                updated_at=now,
+                posts_updated_at=winners.c.posts_updated_at,
+                lease_until=None,
+                lease_owner=None,
+            )
+        )
+        await s.commit()
+
+    for login in login_list:
+        login.updated_at = now
+        login.lease_until = None
+        login.lease_owner = None
+
+
+def build_login_values(login_list: list[InstagramLogins], columns: tuple[str, ...] = None) -> list[dict]:
+    """
+    Marks logins as updated now and returns their column values for a bulk update by primary key.
 
+    Args:
+        login_list: updated logins.
+        columns: only these columns are returned (with `id` and lease), update times of other pipelines are kept.
+    """
+    # update acknowledges the login, the lease of the updated time is released and leases of other pipelines are kept
+    lease_keys = [key for column in columns or ('updated_at',) for key in LEASE_COLUMNS.get(column, ())]
+    other_lease_keys = [key for keys in LEASE_COLUMNS.values() for key in keys if key not in lease_keys]
+    raw_mappings = []
+    for login in login_list:
+        login.updated_at = datetime.now()
+        for key in lease_keys:
+            setattr(login, key, None)
+        login_mapping = dict(login.__dict__)
+        login_mapping.pop('_sa_instance_state', None)
+        if columns:
+            login_mapping = {key: login_mapping[key] for key in ('id', *lease_keys, *columns)}
+        for key in other_lease_keys:
+            login_mapping.pop(key, None)
+        raw_mappings.append(login_mapping)
+    return raw_mappings
 
+
+@metrics.timed(DB_QUERY_DURATION)
 async def update_login_list(session, login_list: list[InstagramLogins]) -> None:
     async with session() as s:
-        raw_mappings = []
-        for login in login_list:
-            login.updated_at = datetime.now()
-            login_mapping = dict(login.__dict__)
-            login_mapping.pop('_sa_instance_state', None)
-            raw_mappings.append(login_mapping)
-
-        await s.execute(update(InstagramLogins), raw_mappings)
+        await s.execute(update(InstagramLogins), build_login_values(login_list))
         await s.commit()
 
 
-async def get_logins_for_update(session) -> list[InstagramLogins]:
-    async with session() as s:
-        not_updated_logins_query = await s.execute(select(InstagramLogins).filter(InstagramLogins.updated_at == None))
-        not_updated_logins = not_updated_logins_query.scalars().all()
+def login_shard(shard_count: int) -> ColumnElement[int]:
+    """
+    Stable shard of a login: the first 28 bits of md5 of its username modulo `shard_count`.
+    Same as `int(hashlib.md5(username.encode()).hexdigest()[:7], 16) % shard_count`.
+    """
+    head = cast(literal('x') + func.substr(func.md5(InstagramLogins.username), 1, 7), BIT(28))
+    return cast(head, Integer) % shard_count
+
+
+async def iter_logins_for_update(
+    session,
+    page_size: int = settings.LOGINS_PAGE_SIZE,
+    updated_at_column: InstrumentedAttribute = InstagramLogins.updated_at,
+    has_user_id: bool = None,
+    shard: tuple[int, int] = None,
+    owner: str = None,
+    lease_sec: int = settings.LEASE_DURATION_SEC,
+) -> AsyncIterator[list[InstagramLogins]]:
+    """
+    Stream logins due for update in keyset-ordered pages: never updated logins first (by id),
+    then outdated existing logins (by update time, id).
+    Logins updated while streaming drop out of the due set and do not shift the pages.
+
+    With `owner` every page is leased for `lease_sec`: due logins are claimed with FOR UPDATE SKIP LOCKED,
+    logins leased by others are skipped until their lease expires, so several nodes can share the table.
+    Every update time has its own lease (see `LEASE_COLUMNS`), so pipelines do not block each other.
+    Leases are extended by `renew_leases` and released by `update_login_list`, `update_new_login_ids`
+    and `release_logins`.
 
-        cutoff_date = datetime.now() - timedelta(days=1)
-        updated_logins_query = await s.execute(
+    Args:
+        session: db session maker.
+        page_size: logins per page.
+        updated_at_column: update time of the pipeline, e.g. `InstagramLogins.posts_updated_at`.
+        has_user_id: only logins with (True) or without (False) resolved user id.
+        shard: (index, count), only logins of the shard `index` out of `count`.
+        owner: lease owner, e.g. node id.
+        lease_sec: lease duration.
+    """
+    lease_until, lease_owner = lease_columns(updated_at_column)
+    filters = [InstagramLogins.is_exists.is_not(False)]
+    if owner:
+        # expired leases are reclaimed
+        filters.append(or_(lease_until == None, lease_until < func.now()))
+    if has_user_id is not None:
+        filters.append(InstagramLogins.user_id != None if has_user_id else InstagramLogins.user_id == None)
+    if shard:
+        index, count = shard
+        filters.append(login_shard(count) == index)
+
+    last_id = 0
+    while True:
+        query = (
             select(InstagramLogins)
-            .where(InstagramLogins.is_exists == True, InstagramLogins.updated_at < cutoff_date)
-            .order_by(InstagramLogins.updated_at)
+            .where(updated_at_column == None, InstagramLogins.id > last_id, *filters)
+            .order_by(InstagramLogins.id)
+            .limit(page_size)
+        )
+        page = await _fetch_page(session, query, owner, lease_sec, updated_at_column)
+        page.sort(key=lambda login: login.id)
+        if page:
+            yield page
+            last_id = page[-1].id
+        if len(page) < page_size:
+            break
+
+    cutoff_date = datetime.now() - timedelta(days=1)
+    last_key = None
+    while True:
+        query = select(InstagramLogins).where(
+            InstagramLogins.is_exists == True, updated_at_column < cutoff_date, *filters
+        )
+        if last_key:
+            query = query.where(tuple_(updated_at_column, InstagramLogins.id) > last_key)
+        query = query.order_by(updated_at_column, InstagramLogins.id).limit(page_size)
+        page = await _fetch_page(session, query, owner, lease_sec, updated_at_column)
+        page.sort(key=lambda login: (getattr(login, updated_at_column.key), login.id))
+        if page:
+            yield page
+            last_key = (getattr(page[-1], updated_at_column.key), page[-1].id)
+        if len(page) < page_size:
+            break
+
+
+async def _fetch_page(
+    session, query: Select, owner: str | None, lease_sec: int, updated_at_column: InstrumentedAttribute
+) -> list[InstagramLogins]:
+    """Select the page or lease it for `owner`, leased rows come back unordered."""
+    async with session() as s:
+        if owner is None:
+            page = await s.execute(query)
+            return list(page.scalars().all())
+
+        lease_until, lease_owner = lease_columns(updated_at_column)
+        claimed = query.with_only_columns(InstagramLogins.id).with_for_update(skip_locked=True)
+        page = await s.execute(
+            update(InstagramLogins)
+            .where(InstagramLogins.id.in_(claimed.scalar_subquery()))
+            .values({lease_until: func.now() + timedelta(seconds=lease_sec), lease_owner: owner})
+            .returning(InstagramLogins)
+            .execution_options(synchronize_session=False)
+        )
+        page = list(page.scalars().all())
+        await s.commit()
+        return page
+
+
+@metrics.timed(DB_QUERY_DURATION)
+async def release_logins(
+    session,
+    login_list: list[InstagramLogins],
+    owner: str,
+    updated_at_column: InstrumentedAttribute = InstagramLogins.updated_at,
+) -> None:
+    """Release leases of logins that were claimed by `owner` but will not be processed."""
+    if not login_list:
+        return
+    lease_until, lease_owner = lease_columns(updated_at_column)
+    async with session() as s:
+        await s.execute(
+            update(InstagramLogins)
+            .where(InstagramLogins.id.in_([login.id for login in login_list]), lease_owner == owner)
+            .values({lease_until: None, lease_owner: None})
         )
-        updated_logins = updated_logins_query.scalars().all()
-        not_updated_logins.extend(updated_logins)
+        await s.commit()
+
 
-        return not_updated_logins
+@metrics.timed(DB_QUERY_DURATION)
+async def renew_leases(
+    session,
+    login_ids: list[int],
+    owner: str,
+    updated_at_column: InstrumentedAttribute = InstagramLogins.updated_at,
+    lease_sec: int = settings.LEASE_DURATION_SEC,
+) -> int:
+    """
+    Extend leases that `owner` still holds for `lease_sec` from now, acknowledged or released logins are skipped.
+    Returns the number of renewed leases.
+    """
+    if not login_ids:
+        return 0
+    lease_until, lease_owner = lease_columns(updated_at_column)
+    async with session() as s:
+        result = await s.execute(
+            update(InstagramLogins)
+            .where(InstagramLogins.id.in_(login_ids), lease_owner == owner)
+            .values({lease_until: func.now() + timedelta(seconds=lease_sec)})
+        )
+        await s.commit()
+    return result.rowcount
+
+
+async def get_logins_for_update(session) -> list[InstagramLogins]:
+    logins = []
+    async for page in iter_logins_for_update(session):
+        logins.extend(page)
+    return logins
 
 
+@metrics.timed(DB_QUERY_DURATION)
 async def mark_as_not_exists(session, username: str = None, user_id: int = None) -> None:
     if username:
         query = (
@@ -1,26 +1,41 @@
 from sqlalchemy.dialects.postgresql import insert
 
+from src.core.metrics import DB_QUERY_DURATION, metrics
 from src.db.models import ParserResult
 from src.parser.clients.models import InstagramClientAnswer
 
 
+# keeps statement parameters count (5 per row) below postgres limit
+INSERT_CHUNK_SIZE = 1000
+
+
+def build_result_values(result_list: list[InstagramClientAnswer]) -> list[dict]:
+    return [
+        {
+            'user_id': result.user_id,
+            'marketplace': story.marketplace.value,
+            'story_publication_date': story.created_at,
+            'sku': story.sku,
+            'ad_type': story.ad_type.value,
+        }
+        for result in result_list
+        for story in result.stories_list
+    ]
+
+
+async def insert_result_values(s, db_values_list: list[dict]) -> None:
+    """Insert rows within the transaction of `s`, one multi-row statement per chunk."""
+    for i in range(0, len(db_values_list), INSERT_CHUNK_SIZE):
+        await s.execute(
+            insert(ParserResult).values(db_values_list[i: i + INSERT_CHUNK_SIZE]).on_conflict_do_nothing()
+        )
+
+
+@metrics.timed(DB_QUERY_DURATION)
 async def add_result_list(session, result_list: list[InstagramClientAnswer]) -> None:
     async with session() as s:
-        db_values_list = []
-        for result in result_list:
-            if result.stories_list:
-                for story in result.stories_list:
-                    db_values_list.append(
-                        {
-                            'user_id': result.user_id,
-                            'marketplace': story.marketplace.value,
-                            'story_publication_date': story.created_at,
-                            'sku': story.sku,
-                            'ad_type': story.ad_type.value,
-                        }
-                    )
+        db_values_list = build_result_values(result_list)
 
         if db_values_list:
-            # If using PostgreSQL, consider on_conflict_do_nothing for ignoring conflicts.
-            await s.execute(insert(ParserResult).values(db_values_list).on_conflict_do_nothing())
+            await insert_result_values(s, db_values_list)
             await s.commit()
@@ -1,35 +1,59 @@
 from sqlalchemy.dialects.postgresql import insert
 
+from src.core.metrics import DB_QUERY_DURATION, metrics
 from src.db.models import ParserResultPost
 from src.parser.clients.models import InstagramClientAnswer
 
 
-async def add_posts_result_list(session, result: InstagramClientAnswer) -> list[ParserResultPost]:
+# keeps statement parameters count (6 per row) below postgres limit
+UPSERT_CHUNK_SIZE = 1000
+
+
+def build_posts_result_values(result: InstagramClientAnswer) -> list[dict]:
+    # dedupe by post_id, the last occurrence wins
+    db_values = {}
+    for post in result.posts_list:
+        db_values[post.post_id] = {
+            'post_id': post.post_id,
+            'user_id': result.user_id,
+            'link': post.url,
+            'comments_count': post.comments_count,
+            'likes_count': post.likes_count,
+            'publication_date': post.created_at,
+        }
+    return list(db_values.values())
+
+
+async def upsert_posts_result_values(s, db_values_list: list[dict]) -> dict[int, int]:
+    """
+    Upsert rows within the transaction of `s`, one multi-row statement per chunk.
+
+    Returns:
+        dict: parser_result_post id by post_id.
+    """
+    post_id_to_id_mapping = {}
+    for i in range(0, len(db_values_list), UPSERT_CHUNK_SIZE):
+        query = insert(ParserResultPost).values(db_values_list[i: i + UPSERT_CHUNK_SIZE])
+        rows = await s.execute(
+            query.on_conflict_do_update(
+                constraint='parser_result_post_post_id',
+                set_={col: getattr(query.excluded, col) for col in db_values_list[0]},
+            ).returning(ParserResultPost.post_id, ParserResultPost.id)
+        )
+        post_id_to_id_mapping.update(rows.tuples().all())
+    return post_id_to_id_mapping
+
+
+@metrics.timed(DB_QUERY_DURATION)
+async def add_posts_result_list(session, result: InstagramClientAnswer) -> dict[int, int]:
+    """
+    Upsert posts with one multi-row statement per chunk.
+
+    Returns:
+        dict: parser_result_post id by post_id.
+    """
     async with session() as s:
-        db_values_list = []
-        if result.posts_list:
-            for post in result.posts_list:
-                db_values_list.append(
-                    {
-                        'post_id': post.post_id,
-                        'user_id': result.user_id,
-                        'link': post.url,
-                        'comments_count': post.comments_count,
-                        'likes_count': post.likes_count,
-                        'publication_date': post.created_at,
-                    }
-                )
-
-        unique_dicts = list({tuple(sorted(d.items())): d for d in db_values_list}.values())
-        result_posts = []
-        for values in unique_dicts:
-            query = insert(ParserResultPost).values(values)
-            result = await s.execute(
-                query.on_conflict_do_update(
-                    constraint='parser_result_post_post_id', set_={col: getattr(query.excluded, col) for col in values}
-                ).returning(ParserResultPost)
-            )
-            result_posts.append(result.scalar())
+        post_id_to_id_mapping = await upsert_posts_result_values(s, build_posts_result_values(result))
         await s.commit()
 
-        return result_posts
+        return post_id_to_id_mapping
@@ -18,6 +18,18 @@ class NoProxyDBError(BaseParserException):
             return f'No proxies of type {self.proxy_type} to work with in db ...'
 
 
+class BufferFlushError(BaseParserException):
+    def __init__(self, rows_count: int, entries_count: int):
+        self.rows_count = rows_count
+        self.entries_count = entries_count
+
+    def __str__(self):
+        return (
+            f'{self.rows_count} buffered rows of {self.entries_count} results cannot be written and are dropped, '
+            f'their logins stay outdated'
+        )
+
+
 class NotEnoughProxyDBError(BaseParserException):
     def __init__(self, account_count: int, proxy_count: int):
         self.proxy_count = proxy_count
@@ -0,0 +1,50 @@
+"""
+Schema changes the parser needs on top of the existing database.
+Statements are idempotent and applied on every start, before worker processes are spawned.
+"""
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from src.core.logs import custom_logger
+from src.db.connector import get_db_pool
+
+
+MIGRATIONS_LOCK_ID = 7_150_002
+
+MIGRATIONS = (
+    # last usage window accounts were reset for, shared by all processes and nodes
+    """
+    CREATE TABLE IF NOT EXISTS usage_reset (
+        id INTEGER PRIMARY KEY,
+        window_start TIMESTAMP WITH TIME ZONE NOT NULL
+    )
+    """,
+    "INSERT INTO usage_reset (id, window_start) VALUES (1, 'epoch') ON CONFLICT DO NOTHING",
+    # leases of logins, ids and stories pipelines share the first one, posts pipeline has its own
+    """
+    ALTER TABLE instagram_logins
+        ADD COLUMN IF NOT EXISTS lease_until TIMESTAMP WITH TIME ZONE,
+        ADD COLUMN IF NOT EXISTS lease_owner VARCHAR(255),
+        ADD COLUMN IF NOT EXISTS posts_lease_until TIMESTAMP WITH TIME ZONE,
+        ADD COLUMN IF NOT EXISTS posts_lease_owner VARCHAR(255)
+    """,
+    # watermark of incremental posts scans
+    'ALTER TABLE instagram_logins ADD COLUMN IF NOT EXISTS newest_post_id BIGINT',
+)
+
+
+async def migrate(engine: AsyncEngine) -> None:
+    async with engine.begin() as conn:
+        # nodes starting at the same time apply migrations one by one
+        await conn.execute(text('SELECT pg_advisory_xact_lock(:lock_id)'), {'lock_id': MIGRATIONS_LOCK_ID})
+        for statement in MIGRATIONS:
+            await conn.execute(text(statement))
+    custom_logger.info(f'{len(MIGRATIONS)} migrations applied')
+
+
+async def apply_migrations() -> None:
+    engine = get_db_pool()
+    try:
+        await migrate(engine)
+    finally:
+        await engine.dispose()
@@ -33,6 +33,21 @@ class InstagramLogins(Base, IdMixin):
     created_at = Column(type_=TIMESTAMP(timezone=True), default=datetime.utcnow)
     updated_at = Column(type_=TIMESTAMP(timezone=True), nullable=True)
     posts_updated_at = Column(type_=TIMESTAMP(timezone=True), nullable=True)
+    # pk of the newest post seen in feed, watermark of incremental posts scans, added by `src.db.migrations`
+    newest_post_id = Column(BigInteger, nullable=True)
+    # leases of parser nodes processing the login, one per update time, added by `src.db.migrations`
+    lease_until = Column(type_=TIMESTAMP(timezone=True), nullable=True)
+    lease_owner = Column(String(255), nullable=True)
+    posts_lease_until = Column(type_=TIMESTAMP(timezone=True), nullable=True)
+    posts_lease_owner = Column(String(255), nullable=True)
+
+
+class UsageReset(Base, IdMixin):
+    """The only row holds the start of the last usage window accounts were reset for."""
+
+    __tablename__ = 'usage_reset'
+
+    window_start = Column(type_=TIMESTAMP(timezone=True), nullable=False)
 
 
 class Proxies(Base, IdMixin):
@@ -1,22 +1,49 @@
+import asyncio
 import concurrent.futures
+from functools import partial
 
 from src.core.config import settings
 from src.core.logs import custom_logger
+from src.core.metrics import start_metrics_server
+from src.db.migrations import apply_migrations
+from src.parser.cache import CacheManager
 from src.parser.parser import Parser
+from src.parser.scheduler import get_shard_counts
 # from src.parser.utils import check_driver_installation
 
 
 def main():
     custom_logger.info('Start parser ...')
     # check_driver_installation()
-    parser = Parser()
+    asyncio.run(apply_migrations())
+    shard_counts = get_shard_counts()
+    process_count = sum(shard_counts.values())
+    custom_logger.info(
+        'Worker processes: ' + ', '.join(f'{count} {pipeline.value}' for pipeline, count in shard_counts.items())
+    )
+    with CacheManager() as cache_manager, concurrent.futures.ProcessPoolExecutor(
+        max_workers=process_count
+    ) as executor:
+        metrics_registry = cache_manager.MetricsRegistry()
+        start_metrics_server(metrics_registry)
+        parser = Parser(
+            wb_sku_cache=cache_manager.TTLCache(settings.WB_SKU_CACHE_SIZE),
+            proxy_health_registry=cache_manager.ProxyHealthRegistry(),
+            metrics_registry=metrics_registry,
+        )
+        # every login is handled by exactly one process of each pipeline
+        futures = [
+            executor.submit(
+                parser.run_async_function,
+                partial(parser.run_pipeline, pipeline=pipeline, shard=(index, count), process_count=process_count),
+                process_count,
+                (pipeline,),
+            )
+            for pipeline, count in shard_counts.items()
+            for index in range(count)
+        ]
 
-    with concurrent.futures.ProcessPoolExecutor(max_workers=settings.PROCESS_COUNT) as executor:
-        futures_stories = executor.submit(parser.run_async_function, parser.get_stories_data)
-        future_ids = executor.submit(parser.run_async_function, parser.get_login_ids_list)
-        future_posts = executor.submit(parser.run_async_function, parser.get_posts_list_by_id)
-
-        for future in concurrent.futures.as_completed((future_ids, future_posts, futures_stories)):
+        for future in concurrent.futures.as_completed(futures):
             try:
                 future.result()
             except Exception as e:  # noqa: PIE786
@@ -0,0 +1,172 @@
+import asyncio
+from collections import deque
+from datetime import datetime
+from typing import Callable
+
+import pytz
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.core.config import settings
+from src.core.logs import custom_logger
+from src.db.crud.instagram_accounts import (
+    get_accounts_for_usage,
+    get_usage_window_start,
+    update_accounts_daily_usage_rate,
+    update_accounts_usage,
+)
+from src.db.exceptions import NoAccountsDBError
+from src.db.models import InstagramAccounts
+
+
+class AccountPool:
+    """
+    In-memory pool of parser accounts of a worker process.
+    Eligible accounts are loaded once and leased in least-recently-used order.
+    Usage counters are updated locally and written back to db in batches every `flush_interval_sec`.
+    """
+
+    def __init__(
+        self,
+        flush_interval_sec: int = settings.ACCOUNT_POOL_FLUSH_INTERVAL_SEC,
+        reload_interval_sec: int = settings.ACCOUNT_POOL_RELOAD_INTERVAL_SEC,
+    ):
+        self.flush_interval_sec = flush_interval_sec
+        self.reload_interval_sec = reload_interval_sec
+        self._accounts: deque[InstagramAccounts] = deque()
+        self._usage: dict[int, dict] = {}
+        self._loaded_at: datetime | None = None
+        self._lock = asyncio.Lock()
+        self._flush_task: asyncio.Task | None = None
+        self._async_session: AsyncSession | None = None
+
+    async def acquire(
+        self, async_session: AsyncSession, is_available: Callable[[InstagramAccounts], bool] = None
+    ) -> InstagramAccounts | None:
+        """
+        Lease the least recently used account.
+
+        Args:
+            async_session: db session maker.
+            is_available: optional filter, accounts rejected by it keep their place in the queue.
+        Returns:
+            InstagramAccounts: leased account or None if all accounts are rejected by `is_available`.
+        """
+        self._async_session = async_session
+        self._start_flushing()
+
+        if self._needs_reload():
+            await self._reload()
+
+        for _ in range(len(self._accounts)):
+            account = self._accounts.popleft()
+            if not self._has_budget(account):
+                continue
+            self._accounts.append(account)
+            if is_available and not is_available(account):
+                continue
+            self._use(account)
+            return account
+
+        if not self._accounts:
+            await self.flush()
+            async with async_session() as s:
+                await update_accounts_daily_usage_rate(s)
+            self._loaded_at = None
+            raise NoAccountsDBError('No account found for parsing')
+        return None
+
+    async def remaining_budget(self, async_session: AsyncSession) -> int:
+        """Number of requests all pooled accounts can still make in the current usage window."""
+        self._async_session = async_session
+        if self._needs_reload():
+            await self._reload()
+        return sum(
+            settings.ACCOUNT_DAILY_USAGE_RATE
+            if self._is_stale(account)
+            else max(settings.ACCOUNT_DAILY_USAGE_RATE - account.daily_usage_rate, 0)
+            for account in self._accounts
+        )
+
+    def wait_time(self, delay: Callable[[InstagramAccounts], float]) -> float:
+        """
+        Args:
+            delay: seconds until an account can be used.
+        Returns:
+            float: seconds until the first account with remaining budget can be used.
+        """
+        return min((delay(account) for account in self._accounts if self._has_budget(account)), default=0)
+
+    def discard(self, account: InstagramAccounts) -> None:
+        self._accounts = deque(acc for acc in self._accounts if acc.id != account.id)
+        self._usage.pop(account.id, None)
+
+    async def flush(self) -> None:
+        if not self._usage or self._async_session is None:
+            return
+        usage, self._usage = self._usage, {}
+        try:
+            async with self._async_session() as s:
+                await update_accounts_usage(s, list(usage.values()))
+        except Exception as ex:  # noqa: PIE786
+            custom_logger.error(f'Cannot flush accounts usage ({type(ex)}): {ex}')
+            # accounts used during the write keep their newer `used_at`, deltas add up,
+            # unless the newer usage was reset: the failed delta belongs to the previous window then
+            for account_id, item in usage.items():
+                if (newer := self._usage.get(account_id)) is None:
+                    self._usage[account_id] = item
+                elif not newer['reset']:
+                    newer.update(delta=item['delta'] + newer['delta'], reset=item['reset'])
+
+    async def close(self) -> None:
+        if self._flush_task:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+
+    def _needs_reload(self) -> bool:
+        return (
+            self._loaded_at is None
+            or (datetime.now(pytz.utc) - self._loaded_at).total_seconds() > self.reload_interval_sec
+        )
+
+    async def _reload(self) -> None:
+        async with self._lock:
+            if not self._needs_reload():
+                return
+            await self.flush()
+            async with self._async_session() as s:
+                self._accounts = deque(await get_accounts_for_usage(s))
+            self._loaded_at = datetime.now(pytz.utc)
+
+    def _start_flushing(self) -> None:
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_periodically())
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval_sec)
+            await self.flush()
+
+    @classmethod
+    def _has_budget(cls, account: InstagramAccounts) -> bool:
+        return account.daily_usage_rate < settings.ACCOUNT_DAILY_USAGE_RATE or cls._is_stale(account)
+
+    @staticmethod
+    def _is_stale(account: InstagramAccounts) -> bool:
+        return bool(account.last_used_at) and account.last_used_at < get_usage_window_start()
+
+    def _use(self, account: InstagramAccounts) -> None:
+        usage = self._usage.setdefault(
+            account.id, {'account_id': account.id, 'delta': 0, 'used_at': None, 'reset': False}
+        )
+        if self._is_stale(account):
+            account.daily_usage_rate = 0
+            usage.update(delta=0, reset=True)
+        else:
+            account.daily_usage_rate += 1
+            usage['delta'] += 1
+        account.last_used_at = datetime.now(pytz.utc)
+        usage['used_at'] = account.last_used_at
+
+
+account_pool = AccountPool()
@@ -0,0 +1,57 @@
+from collections import OrderedDict
+from multiprocessing.managers import BaseManager
+import time
+from typing import Any, Hashable, Iterable
+
+from src.core.metrics import MetricsRegistry
+from src.parser.proxy.health import ProxyHealthRegistry
+
+
+class TTLCache:
+    """
+    Bounded LRU cache with per-entry expiration time.
+    Can be used locally or shared between processes through `CacheManager`,
+    batch methods are preferable in the latter case since every call is a round trip to the manager process.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get_many(self, keys: Iterable[Hashable]) -> dict:
+        """
+        Returns:
+            dict: not expired entries found in cache.
+        """
+        now = time.monotonic()
+        result = {}
+        for key in keys:
+            if (entry := self._data.get(key)) is None:
+                continue
+            expires_at, value = entry
+            if expires_at < now:
+                del self._data[key]
+                continue
+            self._data.move_to_end(key)
+            result[key] = value
+        return result
+
+    def set_many(self, items: dict, ttl: float) -> None:
+        expires_at = time.monotonic() + ttl
+        for key, value in items.items():
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class CacheManager(BaseManager):
+    """Serves caches and registries shared by all worker processes."""
+
+
+CacheManager.register('TTLCache', TTLCache)
+CacheManager.register('ProxyHealthRegistry', ProxyHealthRegistry)
+CacheManager.register('MetricsRegistry', MetricsRegistry)
@@ -1,10 +1,21 @@
+import asyncio
+from contextlib import nullcontext
 from enum import Enum
 import json
 from typing import Any
 
 import aiohttp
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from src.core.metrics import HTTP_REQUEST_DURATION, metrics
+from src.db.connector import current_pipeline
+from src.db.models import InstagramAccounts
+from src.parser.account_pool import account_pool
+from src.parser.clients.decoding import JSONDecoder, json_decoder
 from src.parser.clients.exceptions import ThirdPartyApiException
+from src.parser.clients.sessions import session_registry
+from src.parser.limits import account_buckets, pipeline_limiters, proxy_buckets, proxy_limiters
+from src.parser.proxy.health import proxy_health
 from src.parser.proxy.proxy_handler import convert_to_aiohttp_format
 
 
@@ -17,6 +28,9 @@ class BaseThirdPartyAPIClient:
     api_name = ''
     headers: dict[str, str] = {'accept': '*/*', 'accept-language': 'ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7'}
     base_url = ''
+    json_decoder: JSONDecoder = json_decoder
+    # endpoint (see `_endpoint`) -> schema of its answer, decoders that support schemas skip undeclared fields
+    answer_schemas: dict[str, type] = {}
 
     class HTTPMethods(Enum):
         GET = 'GET'
@@ -25,16 +39,19 @@ class BaseThirdPartyAPIClient:
         PATCH = 'PATCH'
         DELETE = 'DELETE'
 
+    ACCOUNT_MIN_WAIT_SEC = 0.1
+
     async def request(
         self,
         method: HTTPMethods,
         edge: str,
         is_json: bool = True,
-        querystring: dict = None,
+        querystring: dict | list[tuple[str, Any]] = None,
         payload: Any = None,
         proxy: str = None,
         user_agent: str = None,
         cookie: str = None,
+        account_id: int = None,
     ) -> str:
         current_headers = self.headers.copy()
 
@@ -43,21 +60,69 @@ class BaseThirdPartyAPIClient:
         if cookie:
             current_headers.update({'cookie': cookie})
 
-        async with aiohttp.ClientSession(headers=current_headers) as session, session.request(
-            method=method.value,
-            url='/'.join((self.base_url, edge)),
-            proxy=convert_to_aiohttp_format(proxy) if proxy else None,
-            params=querystring,
-            json=payload,
-        ) as res:
-            return await self._clean_response(res, is_json=is_json)
+        # pacing first, so waiting for tokens does not hold concurrency slots
+        if account_id is not None:
+            await account_buckets.get(account_id).acquire()
+        await proxy_buckets.get(proxy).acquire()
+
+        pipeline = current_pipeline.get()
+        session = await session_registry.get_session(current_headers, proxy=proxy)
+        async with (
+            # every API adapts its own limit, e.g. wildberries errors do not throttle instagram requests
+            pipeline_limiters.get((self.api_name, pipeline)).slot() if pipeline else nullcontext(),
+            proxy_limiters.get(proxy).slot(),
+            proxy_health.track(proxy) if proxy else nullcontext(),
+            metrics.timer(HTTP_REQUEST_DURATION, api=self.api_name, endpoint=self._endpoint(edge)),
+            session.request(
+                method=method.value,
+                url='/'.join((self.base_url, edge)),
+                proxy=convert_to_aiohttp_format(proxy) if proxy else None,
+                params=querystring,
+                json=payload,
+            ) as res,
+        ):
+            schema = self.answer_schemas.get(self._endpoint(edge))
+            return await self._clean_response(res, is_json=is_json, schema=schema)
+
+    @classmethod
+    async def _fetch_account(cls, async_session: AsyncSession) -> InstagramAccounts:
+        # sleep until the first account gets a token and a healthy proxy instead of polling
+        while not (account := await account_pool.acquire(async_session, is_available=cls._is_account_available)):
+            await asyncio.sleep(max(account_pool.wait_time(cls._account_delay), cls.ACCOUNT_MIN_WAIT_SEC))
+        return account
+
+    @staticmethod
+    def _account_delay(account: InstagramAccounts) -> float:
+        return max(account_buckets.get(account.id).delay(), proxy_health.retry_in(account.proxy))
 
-    async def _clean_response(self, res, is_json: bool) -> str:
+    @classmethod
+    def _is_account_available(cls, account: InstagramAccounts) -> bool:
+        return not cls._account_delay(account)
+
+    @staticmethod
+    def _endpoint(edge: str) -> str:
+        """Edge without querystring and ids, e.g. 'feed/user/123' -> 'feed/user'."""
+        return '/'.join(part for part in edge.split('?')[0].split('/') if not part.isdigit())
+
+    async def _clean_response(self, res, is_json: bool, schema: type = None) -> str:
         try:
             if res.status != 200:
-                content = await (res.json() if res.content_type == 'application/json' else res.text())
+                content = await (self._json(res) if res.content_type == 'application/json' else res.text())
                 raise ThirdPartyApiException(api_name=self.api_name, answer=content, status=res.status)
 
-            return await (res.json() if is_json else res.text())
+            return await (self._json(res, schema) if is_json else res.text())
         except (json.decoder.JSONDecodeError, aiohttp.client_exceptions.ContentTypeError) as exc:
             raise ThirdPartyApiException(api_name=self.api_name, answer=str(exc), status=res.status)
+
+    async def _json(self, res, schema: type = None) -> Any:
+        # same contract as `ClientResponse.json`, but with pluggable decoder
+        if res.content_type != 'application/json':
+            raise aiohttp.ContentTypeError(
+                res.request_info,
+                res.history,
+                message=f'Attempt to decode JSON with unexpected mimetype: {res.content_type}',
+                headers=res.headers,
+            )
+        if not (body := await res.read()).strip():
+            return None
+        return self.json_decoder.decode(body, schema)
@@ -0,0 +1,69 @@
+import json
+from typing import Any
+
+try:
+    import msgspec
+except ImportError:  # pragma: no cover
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+class JSONDecoder:
+    """
+    Stdlib JSON decoder. Subclasses plug in faster libraries, `schema` is a hint they may use
+    to decode only the declared fields. Invalid documents raise `json.JSONDecodeError`.
+    """
+
+    name = 'json'
+
+    def decode(self, data: bytes, schema: type = None) -> Any:
+        return json.loads(data)
+
+
+class OrjsonDecoder(JSONDecoder):
+    """Decodes whole documents, ignores schemas."""
+
+    name = 'orjson'
+
+    def decode(self, data: bytes, schema: type = None) -> Any:
+        # orjson.JSONDecodeError is a subclass of json.JSONDecodeError
+        return orjson.loads(data)
+
+
+class MsgspecDecoder(JSONDecoder):
+    """Decodes only fields declared by schemas, undeclared fields are skipped without building objects."""
+
+    name = 'msgspec'
+
+    def __init__(self):
+        self._decoders: dict[type | None, msgspec.json.Decoder] = {}
+
+    def decode(self, data: bytes, schema: type = None) -> Any:
+        try:
+            return self._get_decoder(schema).decode(data)
+        except msgspec.ValidationError:
+            # answer does not match the schema, let the client deal with the whole document
+            return self._get_decoder(None).decode(data)
+        except msgspec.DecodeError as ex:
+            raise json.JSONDecodeError(str(ex), data.decode(errors='replace'), 0) from ex
+
+    def _get_decoder(self, schema: type | None) -> 'msgspec.json.Decoder':
+        if (decoder := self._decoders.get(schema)) is None:
+            decoder = self._decoders[schema] = msgspec.json.Decoder(schema) if schema else msgspec.json.Decoder()
+        return decoder
+
+
+def get_json_decoder() -> JSONDecoder:
+    """The fastest available decoder: msgspec, orjson or stdlib."""
+    if msgspec is not None:
+        return MsgspecDecoder()
+    if orjson is not None:
+        return OrjsonDecoder()
+    return JSONDecoder()
+
+
+json_decoder = get_json_decoder()
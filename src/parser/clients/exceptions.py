@@ -50,6 +50,14 @@ class AccountTooManyRequests(ThirdPartyApiException):
         return f'Too many requests from account: {self.account.credentials} ... Delete ...'
 
 
+class LinkNotResolvedError(BaseParserException):
+    def __init__(self, link: str):
+        self.link = link
+
+    def __str__(self):
+        return f'Link {self.link} cannot be resolved now'
+
+
 class ClosedAccountError(ThirdPartyApiException):
     def __init__(self, user_id: int):
         self.user_id = user_id
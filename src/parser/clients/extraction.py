@@ -0,0 +1,54 @@
+import re
+from typing import NamedTuple
+import urllib.parse
+
+from src.parser.clients.models import Marketplaces
+from src.parser.clients.utils import link_pattern
+
+
+INSTAGRAM_REDIRECT_PREFIX = 'https://l.instagram.com/?u='
+
+OZON_MENTIONS = ('ozon', 'озон')
+
+sku_candidate_pattern = re.compile(r'\d{5,10}')
+
+
+class CaptionFeatures(NamedTuple):
+    links: list[str]
+    skus: list[int]
+    is_ozon: bool
+
+
+def extract_caption(caption: str) -> CaptionFeatures:
+    """
+    Extracts everything SKU search needs from a caption, it should be called once per caption.
+    A combined regex with alternatives is slower in CPython than separate precompiled scans,
+    so each feature has its own scan and the link scan is skipped for captions without links.
+
+    Args:
+        caption (str): post caption or story accessibility caption.
+    Returns:
+        CaptionFeatures: links, SKU candidates (digits inside links included) and whether caption refers to ozon.
+    """
+    links = link_pattern.findall(caption) if 'http' in caption else []
+    skus = [int(sku) for sku in sku_candidate_pattern.findall(caption)]
+    lowered = caption.lower()
+    return CaptionFeatures(links, skus, any(mention in lowered for mention in OZON_MENTIONS))
+
+
+def unwrap_link(url: str) -> tuple[str, Marketplaces | None]:
+    """
+    Decodes link sticker url and strips instagram redirect wrapper.
+
+    Returns:
+        tuple: target url and marketplace it points to, if it is known without resolving redirects.
+    """
+    url = urllib.parse.unquote(url)
+    _, is_wrapped, target = url.partition(INSTAGRAM_REDIRECT_PREFIX)
+    url = (target if is_wrapped else url).partition('&e=')[0]
+
+    if 'ozon.ru' in url:
+        return url, Marketplaces.ozon
+    if 'wildberries.ru' in url:
+        return url, Marketplaces.wildberries
+    return url, None
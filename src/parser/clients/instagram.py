@@ -1,8 +1,9 @@
 import asyncio
-import urllib.parse
+from collections import deque
 from datetime import datetime
-import re
+import time
 from time import sleep
+from typing import Iterable
 
 import aiohttp
 from aiohttp import TooManyRedirects
@@ -14,29 +15,39 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.core.config import settings
 from src.core.logs import custom_logger, logger
-from src.db.crud.instagram_accounts import get_account
 from src.db.exceptions import NoProxyDBError
+from src.db.models import InstagramAccounts
+from src.parser.cache import TTLCache
+from src.parser.clients import schemas
 from src.parser.clients.base import BaseThirdPartyAPIClient
 from src.parser.clients.exceptions import (
     AccountConfirmationRequired,
     AccountInvalidCredentials,
     AccountTooManyRequests,
     ClosedAccountError,
+    LinkNotResolvedError,
     LoginNotExistError,
 )
+from src.parser.clients.extraction import CaptionFeatures, extract_caption, unwrap_link
 from src.parser.clients.models import (
     AdType,
     InstagramClientAnswer,
     InstagramPost,
     InstagramStory,
     Marketplaces,
+    PostRecord,
+    SkuHit,
+    StoriesResult,
+    StoryRecord,
     ThirdPartyAPIMediaType,
     ThirdPartyAPISource,
 )
 from src.parser.clients.ozon import OzonClient
-from src.parser.clients.utils import find_links
+from src.parser.clients.redirects import redirect_resolver
 from src.parser.clients.wildberries import WildberriesClient
+from src.parser.limits import stories_batch_sizes
 from src.parser.proxy.exceptions import ProxyTooManyRequests
+from src.parser.proxy.health import proxy_health
 
 
 class InstagramClient(BaseThirdPartyAPIClient):
@@ -46,13 +57,19 @@ class InstagramClient(BaseThirdPartyAPIClient):
 
     api_name = 'InstagramAPI'
     base_url = 'https://www.instagram.com/api/v1'
+    answer_schemas = {
+        'users/web_profile_info': schemas.WebProfileInfo,
+        'feed/user': schemas.FeedUser,
+        'feed/reels_media': schemas.ReelsMedia,
+    }
 
-    ACCOUNT_BAN_TIME_SEC = 5
-    account_banned_list = {}
+    STORY_LIFETIME_SEC = 24 * 60 * 60
 
-    def __init__(self):
+    def __init__(self, wb_sku_cache: TTLCache = None):
         self.ozon = OzonClient()
-        self.wildberries = WildberriesClient()
+        self.wildberries = WildberriesClient(sku_cache=wb_sku_cache)
+        # pk of already processed stories
+        self.seen_stories = TTLCache(settings.SEEN_STORIES_CACHE_SIZE)
 
     async def get_info_by_user_name(self, async_session: AsyncSession, username: str) -> InstagramClientAnswer:
         try:
@@ -65,6 +82,7 @@ class InstagramClient(BaseThirdPartyAPIClient):
                 cookie=account.cookies,
                 user_agent=account.user_agent,
                 proxy=account.proxy,
+                account_id=account.id,
             )
             if not raw_data['data']['user']:
                 raise LoginNotExistError(username=username)
@@ -78,40 +96,76 @@ class InstagramClient(BaseThirdPartyAPIClient):
         except Exception as ex:
             await self._handle_exceptions(ex, account=account, username=username)
 
-    async def _process_post(self, async_session: AsyncSession, post: dict, from_datetime: datetime = None):
-        created_at = datetime.fromtimestamp(post['taken_at'], tz=pytz.utc)
-        if from_datetime and created_at > from_datetime:
-            return []
-
-        caption = post['caption']['text'] if post['caption'] else ''
-        comments_count = post['comment_count']
-        likes_count = post['like_count']
-        url = 'https://www.instagram.com/p/' + post['code']
-
-        parsed_post_base = InstagramPost(
-            post_id=post['pk'],
-            created_at=created_at,
-            caption=caption,
-            likes_count=likes_count,
-            comments_count=comments_count,
-            url=url,
+    @staticmethod
+    def _is_known_post(post: dict, from_datetime: datetime = None, newest_post_id: int = None) -> bool:
+        """Post was published before the previous scan of the feed."""
+        return bool(
+            from_datetime
+            and datetime.fromtimestamp(post['taken_at'], tz=pytz.utc) < from_datetime
+            or newest_post_id
+            and int(post['pk']) <= newest_post_id
         )
-        links = find_links(caption)
-        parsed_post_copies = [parsed_post_base.model_copy() for _ in links]
 
-        await asyncio.gather(*(self._extract_sku_from_link(p, l) for p, l in zip(parsed_post_copies, links)))
-        posts_with_caption = await self._extract_sku_from_caption(
-            async_session=async_session, item=parsed_post_base, caption=caption
+    def _parse_post(self, post: dict) -> PostRecord:
+        return PostRecord(
+            post_id=int(post['pk']),
+            created_at=datetime.fromtimestamp(post['taken_at'], tz=pytz.utc),
+            caption=post['caption']['text'] if post['caption'] else '',
+            likes_count=post['like_count'],
+            comments_count=post['comment_count'],
+            url='https://www.instagram.com/p/' + post['code'],
         )
 
-        return [p for p in (parsed_post_copies + posts_with_caption) if p.sku]
+    async def _process_post(
+        self, post: PostRecord, features: CaptionFeatures, wb_brands: dict[int, tuple[str, int]]
+    ) -> list[InstagramPost]:
+        link_hits = await asyncio.gather(*(self._extract_sku_from_link(link) for link in features.links))
+        hits = [hit for hit in link_hits if hit] + self._extract_sku_from_caption(features, wb_brands)
+        return [
+            InstagramPost(
+                post_id=post.post_id,
+                created_at=post.created_at,
+                url=hit.url or post.url,
+                caption=post.caption,
+                sku=hit.sku,
+                marketplace=hit.marketplace,
+                ad_type=hit.ad_type,
+                likes_count=post.likes_count,
+                comments_count=post.comments_count,
+                brand=hit.brand,
+                brand_id=hit.brand_id,
+            )
+            for hit in hits
+        ]
+
+    @staticmethod
+    def _make_story(story: StoryRecord, hit: SkuHit) -> InstagramStory:
+        return InstagramStory(
+            media_type=story.media_type,
+            url=hit.url or story.url,
+            created_at=story.created_at,
+            sku=hit.sku,
+            marketplace=hit.marketplace,
+            ad_type=hit.ad_type,
+            brand=hit.brand,
+            brand_id=hit.brand_id,
+        )
 
     async def get_posts_by_id(
-        self, async_session: AsyncSession, user_id: int, from_datetime: datetime = None
+        self, async_session: AsyncSession, user_id: int, from_datetime: datetime = None, newest_post_id: int = None
     ) -> InstagramClientAnswer:
+        """
+        Fetch feed posts with SKUs. The feed is newest first, so in incremental mode (`from_datetime` is
+        the previous scan time or `newest_post_id` of the previous scan is known) paging stops at the first page
+        that reaches already known posts, and known posts are not processed.
+        The answer carries the new watermark, it is stored with the posts.
+        """
+        if from_datetime and from_datetime.tzinfo is None:
+            from_datetime = from_datetime.astimezone(pytz.utc)
         try:
             result_list = []
             next_max_id = None
+            scan_newest_post_id = newest_post_id
             while len(result_list) < 500:
                 account = await self._fetch_account(async_session)
                 raw_data = await self.request(
@@ -122,18 +176,27 @@ class InstagramClient(BaseThirdPartyAPIClient):
                     cookie=account.cookies,
                     user_agent=account.user_agent,
                     proxy=account.proxy,
+                    account_id=account.id,
                 )
 
                 if not raw_data.get('user'):
                     raise LoginNotExistError(user_id=user_id)
 
-                result = await asyncio.gather(
-                    *(self._process_post(async_session, p, from_datetime) for p in raw_data['items'])
-                )
+                # pinned posts are shown first regardless of their age
+                items = [i for i in raw_data['items'] if not (i.get('timeline_pinned_user_ids') or i.get('is_pinned'))]
+                new_items = [i for i in items if not self._is_known_post(i, from_datetime, newest_post_id)]
+                if new_items:
+                    scan_newest_post_id = max(scan_newest_post_id or 0, *(int(i['pk']) for i in new_items))
+
+                # all caption SKUs of the page are validated in one batch
+                posts = [self._parse_post(i) for i in new_items]
+                features = [extract_caption(p.caption) for p in posts]
+                wb_brands = await self._check_caption_skus(async_session, features)
+                result = await asyncio.gather(*(self._process_post(p, f, wb_brands) for p, f in zip(posts, features)))
 
                 result_list.extend([i for sublist in result for i in sublist])
 
-                if not raw_data['more_available']:
+                if not raw_data['more_available'] or len(new_items) < len(items):
                     break
 
                 next_max_id = raw_data['next_max_id']
@@ -143,6 +206,7 @@ class InstagramClient(BaseThirdPartyAPIClient):
                 username=raw_data['user']['username'],
                 user_id=user_id,
                 posts_list=result_list,
+                newest_post_id=scan_newest_post_id,
             )
 
         except Exception as ex:
@@ -150,114 +214,188 @@ class InstagramClient(BaseThirdPartyAPIClient):
 
     async def get_stories_by_id(
         self, async_session: AsyncSession, user_id_list: list[int]
+    ) -> StoriesResult:
+        """
+        Requests stories in batches sized for the proxy of each account.
+        Failed batches are split in halves and retried, a single id that still fails is skipped,
+        or its login error is returned. An account error stops requests, answers collected before it are kept.
+        """
+        result = StoriesResult(answers=[], skipped_ids=[], login_errors=[])
+        pending = deque([user_id_list])
+        while pending:
+            user_ids = pending.popleft()
+            account = await self._fetch_account(async_session)
+            sizer = stories_batch_sizes.get(account.proxy)
+            if len(user_ids) > sizer.size:
+                pending.appendleft(user_ids[sizer.size:])
+                user_ids = user_ids[: sizer.size]
+
+            started_at = time.monotonic()
+            try:
+                answers = await self._get_stories_batch(async_session, account, user_ids)
+            except (AccountInvalidCredentials, AccountConfirmationRequired, AccountTooManyRequests) as ex:
+                result.account_error = ex
+                result.skipped_ids.extend(user_ids)
+                result.skipped_ids.extend(user_id for ids in pending for user_id in ids)
+                break
+            except Exception as ex:
+                is_login_error = isinstance(ex, (LoginNotExistError, ClosedAccountError))
+                if len(user_ids) == 1 and is_login_error:
+                    result.login_errors.append(ex)
+                    continue
+                # a missing login fails its batch, but says nothing about the proxy
+                if not is_login_error:
+                    sizer.on_failure()
+                if proxy := getattr(ex, 'proxy', None):
+                    proxy_health.trip(proxy)
+                if len(user_ids) == 1:
+                    custom_logger.warning(f'Stories of login with id {user_ids[0]} skipped ({type(ex)}): {ex}')
+                    result.skipped_ids.append(user_ids[0])
+                    continue
+                middle = len(user_ids) // 2
+                pending.extendleft([user_ids[middle:], user_ids[:middle]])
+                continue
+
+            stories_count = sum(len(answer.processed_story_ids) for answer in answers)
+            sizer.on_success(len(user_ids), time.monotonic() - started_at, stories_count)
+            result.answers.extend(answers)
+        return result
+
+    async def _get_stories_batch(
+        self, async_session: AsyncSession, account: InstagramAccounts, user_id_list: list[int]
     ) -> list[InstagramClientAnswer]:
         try:
-            account = await self._fetch_account(async_session)
-            querystring = ''.join([f'reel_ids={_}&' for _ in user_id_list])
             raw_data = await self.request(
                 method=BaseThirdPartyAPIClient.HTTPMethods.GET,
-                edge=f'feed/reels_media?{querystring}',
+                edge='feed/reels_media',
+                querystring=[('reel_ids', user_id) for user_id in user_id_list],
                 is_json=True,
                 cookie=account.cookies,
                 user_agent=account.user_agent,
                 proxy=account.proxy,
+                account_id=account.id,
             )
             stories_by_accounts = []
             if raw_data['reels']:
+                # stories processed on previous passes are skipped
+                seen = self.seen_stories.get_many(
+                    [int(item['pk']) for reel in raw_data['reels'].values() for item in reel['items']]
+                )
+                new_items = {
+                    user_id: [item for item in reel['items'] if int(item['pk']) not in seen]
+                    for user_id, reel in raw_data['reels'].items()
+                }
+
+                # all caption SKUs of the response are validated in one batch
+                features = {
+                    item['pk']: extract_caption(item['accessibility_caption'])
+                    for items in new_items.values()
+                    for item in items
+                    if item.get('accessibility_caption')
+                }
+                wb_brands = await self._check_caption_skus(async_session, features.values())
                 for user_id in raw_data['reels']:
                     stories_list = []
+                    # stories with links failed to resolve are not marked processed and are tried again
+                    unresolved = set()
                     username = raw_data['reels'][user_id]['user']['username']
-                    for item in raw_data['reels'][user_id]['items']:
+                    for item in new_items[user_id]:
                         if not (story := self._extract_story_from_item(item)):
                             continue
 
                         # text in story
                         if item.get('accessibility_caption'):
                             logger.info("Extracting from caption")
-                            story_list = await self._extract_sku_from_caption(
-                                async_session=async_session, item=story, caption=item['accessibility_caption'].lower()
-                            )
-                            stories_list.extend(story_list)
+                            hits = self._extract_sku_from_caption(features[item['pk']], wb_brands)
 
                         # link sticker in story
                         elif item.get('story_link_stickers'):
                             logger.info("Extracting from link")
-                            await self._extract_sku_from_link(
-                                story, item['story_link_stickers'][0]['story_link']['url']
-                            )
-
-                        if story.sku:
-                            stories_list.append(story)
+                            try:
+                                hit = await self._extract_sku_from_link(
+                                    item['story_link_stickers'][0]['story_link']['url']
+                                )
+                            except LinkNotResolvedError as ex:
+                                custom_logger.warning(ex)
+                                unresolved.add(item['pk'])
+                                continue
+                            hits = [hit] if hit else []
+                        else:
+                            hits = []
+
+                        stories_list.extend(self._make_story(story, hit) for hit in hits)
 
                     stories_by_accounts.append(
                         InstagramClientAnswer(
                             source=ThirdPartyAPISource.instagram,
                             username=username,
                             stories_list=stories_list,
-                            user_id=user_id
+                            user_id=user_id,
+                            processed_story_ids={
+                                int(item['pk']): item['taken_at']
+                                for item in new_items[user_id]
+                                if item['pk'] not in unresolved
+                            },
                         )
                     )
             return stories_by_accounts
         except Exception as ex:
-            await self._handle_exceptions(ex, account=account)
+            user_id = user_id_list[0] if len(user_id_list) == 1 else None
+            await self._handle_exceptions(ex, account=account, user_id=user_id)
 
-    def _extract_story_from_item(self, item):
+    def mark_stories_seen(self, answers: list[InstagramClientAnswer]) -> None:
+        """Remember processed stories until they expire, should be called once their results are stored."""
+        now = time.time()
+        for answer in answers:
+            for pk, taken_at in answer.processed_story_ids.items():
+                if (ttl := taken_at + self.STORY_LIFETIME_SEC - now) > 0:
+                    self.seen_stories.set_many({pk: True}, ttl)
+
+    def _extract_story_from_item(self, item) -> StoryRecord | None:
         if item['media_type'] == ThirdPartyAPIMediaType.photo.value:
-            return InstagramStory(
-                media_type=ThirdPartyAPIMediaType.photo.value,
+            return StoryRecord(
+                media_type=ThirdPartyAPIMediaType.photo,
                 url=item['image_versions2']['candidates'][0]['url'],
                 created_at=item['taken_at'],
             )
         elif item['media_type'] == ThirdPartyAPIMediaType.video.value:
-            return InstagramStory(
-                media_type=ThirdPartyAPIMediaType.video.value,
+            return StoryRecord(
+                media_type=ThirdPartyAPIMediaType.video,
                 url=item['video_versions'][0]['url'],
                 created_at=item['taken_at'],
             )
         return None
 
-    async def _extract_sku_from_caption(
-        self, async_session: AsyncSession, item: InstagramStory | InstagramPost, caption: str
-    ) -> list[InstagramStory | InstagramPost]:
-        caption = caption.lower()
-
-        # keywords = ('артикул', 'sku', 'articul')
-
-        skus = re.findall(r'\d{5,10}', caption) #if any(keyword in caption for keyword in keywords) else []
-
-        results = []
-
-        for sku in skus:
-            item_copy = item.model_copy()
-            item_copy.sku = sku
-
-            if any(oz in caption for oz in ('ozon', 'озон')):
-                item_copy.marketplace = Marketplaces.ozon
-            elif await self.wildberries.check_sku(async_session, item_copy):
-                item_copy.marketplace = Marketplaces.wildberries
-            item_copy.ad_type = AdType.text
-            if item_copy.marketplace and item_copy.sku:
-                results.append(item_copy)
-
-        return results
-
-    async def _extract_sku_from_link(self, story, url):
+    async def _check_caption_skus(
+        self, async_session: AsyncSession, features: Iterable[CaptionFeatures]
+    ) -> dict[int, tuple[str, int]]:
+        candidates = set()
+        for feature in features:
+            if not feature.is_ozon:
+                candidates.update(feature.skus)
+        if not candidates:
+            return {}
+        return await self.wildberries.check_sku_list(async_session, candidates)
+
+    @staticmethod
+    def _extract_sku_from_caption(features: CaptionFeatures, wb_brands: dict[int, tuple[str, int]]) -> list[SkuHit]:
+        if features.is_ozon:
+            return [SkuHit(sku, Marketplaces.ozon, AdType.text) for sku in features.skus if sku]
+        return [
+            SkuHit(sku, Marketplaces.wildberries, AdType.text, *brand)
+            for sku in features.skus
+            if sku and (brand := wb_brands.get(sku))
+        ]
+
+    async def _extract_sku_from_link(self, url: str) -> SkuHit | None:
         try:
-            decoded_url = urllib.parse.unquote(url)
-            if 'https://l.instagram.com/?u=' in decoded_url:
-                decoded_url = decoded_url.split('https://l.instagram.com/?u=')[1]
-            if '&e=' in decoded_url:
-                decoded_url = decoded_url.split("&e=")[0]
-            story.url = decoded_url
-            if 'ozon.ru' in story.url:
-                story.marketplace = Marketplaces.ozon
-                story.sku = self.ozon.extract_sku_from_url(story.url)
-            elif 'wildberries.ru' in story.url:
-                story.marketplace = Marketplaces.wildberries
-                story.sku = self.wildberries.extract_sku_from_url(story.url)
+            link, marketplace = unwrap_link(url)
+            if marketplace == Marketplaces.ozon:
+                sku = self.ozon.extract_sku_from_url(link)
+            elif marketplace == Marketplaces.wildberries:
+                sku = self.wildberries.extract_sku_from_url(link)
             else:
-                story.sku = resolve_redirection_link(decoded_url)  # TODO make it async
-                story.marketplace = Marketplaces.wildberries
+                marketplace, sku = await redirect_resolver.resolve(link)
 
                 # story.url = await self._resolve_stories_link(url)
                 # if 'ozon.ru' in story.url:
@@ -268,8 +406,8 @@ class InstagramClient(BaseThirdPartyAPIClient):
                 #     story.sku = self.wildberries.extract_sku_from_url(story.url)
                 #     if story.sku:
                 #         logger.info(f"{decoded_url}")
-            story.ad_type = AdType.link
-        except NoProxyDBError as ex:
+            return SkuHit(sku, marketplace, AdType.link, url=link) if sku else None
+        except (NoProxyDBError, LinkNotResolvedError) as ex:
             raise ex
         # except WebDriverException:
         #     pass
@@ -277,6 +415,7 @@ class InstagramClient(BaseThirdPartyAPIClient):
             if str(ex) != 'Retry of page load timed out after 120.0 seconds!':
                 custom_logger.error(f'{type(ex)}: {ex}')
                 custom_logger.error('url: ' + url)
+            return None
 
     # async def _resolve_stories_link(self, url: str) -> str:
     #     def sync_resolve_stories_link(url: str) -> str:
@@ -363,10 +502,10 @@ class InstagramClient(BaseThirdPartyAPIClient):
                 error = error[ex.answer['message']]
 
             if issubclass(error, ClosedAccountError):
-                raise error(user_id=kwargs['user_id'])
+                raise error(user_id=kwargs.get('user_id'))
 
             if issubclass(error, LoginNotExistError):
-                raise error(username=kwargs['username'])
+                raise error(username=kwargs.get('username'), user_id=kwargs.get('user_id'))
 
             if issubclass(error, (ProxyTooManyRequests, AccountTooManyRequests)):
                 raise error(proxy=kwargs['account'].proxy)
@@ -374,62 +513,3 @@ class InstagramClient(BaseThirdPartyAPIClient):
             raise error(account=kwargs['account'])
 
         raise ex
-
-    @classmethod
-    async def _fetch_account(cls, async_session: AsyncSession):
-        async with async_session() as s:
-            while True:
-                account = await get_account(s)
-                if (
-                    account.proxy in cls.account_banned_list
-                    and (datetime.now(pytz.utc) - cls.account_banned_list[account.proxy]).seconds
-                    > cls.ACCOUNT_BAN_TIME_SEC
-                    or account.proxy not in cls.account_banned_list
-                ):
-                    return account
-
-    @classmethod
-    def ban_account(cls, proxy: str):
-        cls.account_banned_list.update({proxy: datetime.now(pytz.utc)})
-
-
-import requests
-wb_sku_pattern = re.compile(r'\d{5,}')
-wb_size_pattern = re.compile(r'(?<=size=)\d+')
-wb_link_pattern = re.compile(r'(?:(?:(?:wb)|(?:wildberries))\.ru(?:(?:/catalog/)|(?:/product\?card=)))\d+')
-
-
-def resolve_redirection_link(link):
-    # logger.debug(f'RESOLVING {link}')
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) '
-                      'Chrome/39.0.2171.95 Safari/537.36'
-    }
-    if not link.startswith('http'):
-        link = f'https://{link}'
-    try:
-        response = requests.get(link, timeout=15, headers=headers)
-    except Exception as e:  # (TimeOut, InvalidURL, ConnectionError, MissingSchema, InvalidSchema):
-
-        return
-    sku = get_sku_from_url(response.url)
-    if sku is not None:
-        return int(sku)
-    if len(response.history) != 0:
-        sku = get_sku_from_url(response.history[0].url)
-    if sku is not None:
-        return int(sku)
-    return get_sku_from_text(response.text)
-
-
-def get_sku_from_url(link):
-    link = urllib.parse.quote(link)
-    return get_sku_from_text(link)
-
-
-def get_sku_from_text(text):
-    link_res = wb_link_pattern.findall(text)
-    if link_res:
-        sku = wb_sku_pattern.findall(link_res[0])
-        if sku:
-            return int(sku[0])
@@ -1,3 +1,4 @@
+from dataclasses import dataclass
 from datetime import datetime
 from enum import Enum
 
@@ -50,8 +51,8 @@ class InstagramStory(BaseModel):
     sku: int = Field(default=None)
     marketplace: Marketplaces = Field(default=None)
     ad_type: AdType = Field(default=None)
-    brand: str = Field(default=None)
-    brand_id: int = Field(default=None)
+    brand: str | None = Field(default=None)
+    brand_id: int | None = Field(default=None)
 
 
 class InstagramPost(BaseModel):
@@ -65,8 +66,40 @@ class InstagramPost(BaseModel):
     ad_type: AdType = Field(default=None)
     likes_count: int = Field(default=None)
     comments_count: int = Field(default=None)
-    brand: str = Field(default=None)
-    brand_id: int = Field(default=None)
+    brand: str | None = Field(default=None)
+    brand_id: int | None = Field(default=None)
+
+
+# Lightweight records of the extraction layer, pydantic models are built only for confirmed SKUs.
+
+
+@dataclass(slots=True)
+class PostRecord:
+    post_id: int
+    created_at: datetime
+    caption: str
+    likes_count: int
+    comments_count: int
+    url: str
+
+
+@dataclass(slots=True)
+class StoryRecord:
+    media_type: ThirdPartyAPIMediaType
+    url: str
+    # unix timestamp
+    created_at: int
+
+
+@dataclass(slots=True)
+class SkuHit:
+    sku: int
+    marketplace: Marketplaces
+    ad_type: AdType
+    brand: str = None
+    brand_id: int = None
+    # link the SKU was found by, replaces url of the post or story
+    url: str = None
 
 
 class ThirdPartyAPIClientAnswer(BaseModel):
@@ -83,3 +116,20 @@ class InstagramClientAnswer(ThirdPartyAPIClientAnswer):
     followers_number: int = Field(default=None)
     stories_list: list[InstagramStory] = Field(default_factory=list)
     posts_list: list[InstagramPost] = Field(default_factory=list)
+    # pk -> taken_at timestamp of stories processed in this answer
+    processed_story_ids: dict[int, int] = Field(default_factory=dict)
+    # pk of the newest post of the scanned feed
+    newest_post_id: int = Field(default=None)
+
+
+@dataclass(slots=True)
+class StoriesResult:
+    """Stories of a list of logins, requested in several batches."""
+
+    answers: list[InstagramClientAnswer]
+    # ids of logins failed by other errors, they are requested again later
+    skipped_ids: list[int]
+    # login errors of single logins, e.g. LoginNotExistError
+    login_errors: list[Exception]
+    # account error that stopped requests, ids not requested yet are skipped
+    account_error: Exception | None = None
@@ -0,0 +1,91 @@
+import asyncio
+from urllib.parse import urljoin
+
+import aiohttp
+
+from src.core.config import settings
+from src.parser.clients.exceptions import LinkNotResolvedError
+from src.parser.clients.models import Marketplaces
+from src.parser.clients.ozon import OzonClient
+from src.parser.clients.sessions import session_registry
+from src.parser.clients.utils import get_sku_from_text, get_sku_from_url
+
+
+class RedirectResolver:
+    """
+    Resolves short/redirect links to marketplace SKUs without blocking the event loop.
+    Redirects are followed hop by hop and resolving stops at the first ozon/wildberries url with SKU,
+    only the last page body is downloaded (and only if no SKU was found in urls).
+    """
+
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) '
+                      'Chrome/39.0.2171.95 Safari/537.36'
+    }
+    REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+    MAX_HOPS = 10
+    MAX_BODY_SIZE = 512 * 1024
+
+    def __init__(
+        self,
+        concurrency: int = settings.REDIRECT_RESOLVER_CONCURRENCY,
+        timeout_sec: int = settings.REDIRECT_RESOLVER_TIMEOUT_SEC,
+    ):
+        self.timeout_sec = timeout_sec
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def resolve(self, link: str) -> tuple[Marketplaces | None, int | None]:
+        """
+        Args:
+            link (str): link to resolve.
+        Returns:
+            tuple: marketplace and SKU or (None, None) if link leads to no SKU.
+        Raises:
+            LinkNotResolvedError: link cannot be resolved within timeout budget or the host is unavailable.
+        """
+        if not link.startswith('http'):
+            link = f'https://{link}'
+        try:
+            async with self._semaphore:
+                return await asyncio.wait_for(self._resolve(link), self.timeout_sec)
+        except (asyncio.TimeoutError, aiohttp.ClientError) as ex:
+            raise LinkNotResolvedError(link) from ex
+        except ValueError:
+            return None, None
+
+    async def _resolve(self, url: str) -> tuple[Marketplaces | None, int | None]:
+        session = await session_registry.get_session(self.headers)
+        for _ in range(self.MAX_HOPS):
+            if (result := self._extract_sku(url))[1]:
+                return result
+
+            location, body = await self._hop(session, url)
+            if location is None:
+                if sku := get_sku_from_text(body):
+                    return Marketplaces.wildberries, sku
+                break
+            url = urljoin(url, location)
+        return None, None
+
+    async def _hop(self, session: aiohttp.ClientSession, url: str) -> tuple[str | None, str]:
+        async with session.head(url, allow_redirects=False) as res:
+            if res.status in self.REDIRECT_STATUSES and 'Location' in res.headers:
+                return res.headers['Location'], ''
+
+        # some hosts redirect on GET only, or the final page contains product link in its body
+        async with session.get(url, allow_redirects=False) as res:
+            if res.status in self.REDIRECT_STATUSES and 'Location' in res.headers:
+                return res.headers['Location'], ''
+            body = await res.content.read(self.MAX_BODY_SIZE)
+            return None, body.decode('utf-8', errors='ignore')
+
+    @staticmethod
+    def _extract_sku(url: str) -> tuple[Marketplaces | None, int | None]:
+        if 'ozon.ru' in url and (sku := OzonClient.extract_sku_from_url(url)):
+            return Marketplaces.ozon, sku
+        if sku := get_sku_from_url(url):
+            return Marketplaces.wildberries, sku
+        return None, None
+
+
+redirect_resolver = RedirectResolver()
@@ -0,0 +1,110 @@
+"""
+Typed schemas of third party API answers.
+Only fields read by the clients are declared, decoders that support schemas skip everything else.
+"""
+from typing import TypedDict
+
+
+class User(TypedDict, total=False):
+    pk: int | str
+    username: str
+
+
+class Caption(TypedDict, total=False):
+    text: str
+
+
+class ImageCandidate(TypedDict, total=False):
+    url: str
+
+
+class ImageVersions(TypedDict, total=False):
+    candidates: list[ImageCandidate]
+
+
+class VideoVersion(TypedDict, total=False):
+    url: str
+
+
+class StoryLink(TypedDict, total=False):
+    url: str
+
+
+class StoryLinkSticker(TypedDict, total=False):
+    story_link: StoryLink
+
+
+class FeedItem(TypedDict, total=False):
+    pk: int | str
+    code: str
+    taken_at: int
+    caption: Caption | None
+    like_count: int
+    comment_count: int
+    timeline_pinned_user_ids: list[int | str]
+    is_pinned: bool
+
+
+class FeedUser(TypedDict, total=False):
+    """`feed/user/{user_id}`"""
+
+    items: list[FeedItem]
+    more_available: bool
+    next_max_id: str | None
+    user: User | None
+
+
+class StoryItem(TypedDict, total=False):
+    pk: int | str
+    taken_at: int
+    media_type: int
+    accessibility_caption: str | None
+    image_versions2: ImageVersions
+    video_versions: list[VideoVersion]
+    story_link_stickers: list[StoryLinkSticker]
+
+
+class Reel(TypedDict, total=False):
+    items: list[StoryItem]
+    user: User
+
+
+class ReelsMedia(TypedDict, total=False):
+    """`feed/reels_media`"""
+
+    reels: dict[str, Reel]
+
+
+class FollowedBy(TypedDict, total=False):
+    count: int
+
+
+class ProfileUser(TypedDict, total=False):
+    id: str
+    edge_followed_by: FollowedBy
+
+
+class ProfileData(TypedDict, total=False):
+    user: ProfileUser | None
+
+
+class WebProfileInfo(TypedDict, total=False):
+    """`users/web_profile_info`"""
+
+    data: ProfileData
+
+
+class Product(TypedDict, total=False):
+    id: int
+    brand: str | None
+    brandId: int | None  # noqa: N815
+
+
+class ProductsData(TypedDict, total=False):
+    products: list[Product] | None
+
+
+class CardsDetail(TypedDict, total=False):
+    """Wildberries `cards/detail`"""
+
+    data: ProductsData
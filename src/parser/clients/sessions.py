@@ -0,0 +1,62 @@
+from collections import OrderedDict
+
+import aiohttp
+
+from src.core.config import settings
+
+
+class HTTPSessionRegistry:
+    """
+    Keeps long-lived aiohttp sessions, so keep-alive connections through a proxy are reused between requests.
+    There is one connector (connection pool) per proxy and one session per (proxy, headers) identity on top of it.
+    Sessions are bound to the event loop they were created in, so the registry must be closed before the loop.
+    """
+
+    def __init__(self, max_sessions: int = settings.HTTP_MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._connectors: dict[str | None, aiohttp.TCPConnector] = {}
+        self._sessions: OrderedDict[tuple, aiohttp.ClientSession] = OrderedDict()
+
+    def _get_connector(self, proxy: str | None) -> aiohttp.TCPConnector:
+        connector = self._connectors.get(proxy)
+        if connector is None or connector.closed:
+            connector = aiohttp.TCPConnector(
+                limit=settings.HTTP_POOL_LIMIT,
+                limit_per_host=settings.HTTP_POOL_LIMIT_PER_HOST,
+                keepalive_timeout=settings.HTTP_KEEPALIVE_TIMEOUT_SEC,
+                ttl_dns_cache=settings.HTTP_DNS_CACHE_TTL_SEC,
+            )
+            self._connectors[proxy] = connector
+        return connector
+
+    async def get_session(self, headers: dict[str, str], proxy: str = None) -> aiohttp.ClientSession:
+        key = (proxy, tuple(sorted(headers.items())))
+        session = self._sessions.get(key)
+        if session is not None and not session.closed:
+            self._sessions.move_to_end(key)
+            return session
+
+        # cookies are passed explicitly in headers, so responses must not change the session identity
+        session = aiohttp.ClientSession(
+            headers=headers,
+            connector=self._get_connector(proxy),
+            connector_owner=False,
+            cookie_jar=aiohttp.DummyCookieJar(),
+        )
+        self._sessions[key] = session
+
+        while len(self._sessions) > self.max_sessions:
+            _, old_session = self._sessions.popitem(last=False)
+            await old_session.close()
+        return session
+
+    async def close(self) -> None:
+        for session in self._sessions.values():
+            await session.close()
+        for connector in self._connectors.values():
+            await connector.close()
+        self._sessions.clear()
+        self._connectors.clear()
+
+
+session_registry = HTTPSessionRegistry()
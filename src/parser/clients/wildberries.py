@@ -1,9 +1,13 @@
+import asyncio
+from typing import Iterable
 from urllib.parse import urlparse
 
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from src.core.config import settings
 from src.parser.clients.models import InstagramStory, InstagramPost
-from src.db.crud.instagram_accounts import get_account
+from src.parser.cache import TTLCache
+from src.parser.clients import schemas
 from src.parser.clients.base import BaseThirdPartyAPIClient
 
 
@@ -15,6 +19,14 @@ class WildberriesClient(BaseThirdPartyAPIClient):
     api_name = 'WildberrisAPI'
     base_url = 'https://card.wb.ru'
     regions = '80,115,38,4,64,83,33,68,70,69,30,86,75,40,1,66,110,22,31,48,71,114'
+    answer_schemas = {'cards/detail': schemas.CardsDetail}
+
+    MAX_SKU_PER_REQUEST = 100
+
+    def __init__(self, sku_cache: TTLCache = None):
+        # (brand, brand_id) for existing SKUs and None for missing ones
+        self.sku_cache = sku_cache if sku_cache is not None else TTLCache(settings.WB_SKU_CACHE_SIZE)
+        self._in_flight: dict[int, asyncio.Future] = {}
 
     async def check_sku(self, async_session: AsyncSession, item: InstagramStory | InstagramPost) -> bool:
         """
@@ -25,26 +37,78 @@ class WildberriesClient(BaseThirdPartyAPIClient):
         Returns:
             bool: True if SKU exists, False otherwise.
         """
-        async with async_session() as s:
-            account = await get_account(s)
+        if brand := (await self.check_sku_list(async_session, [item.sku])).get(int(item.sku)):
+            item.brand, item.brand_id = brand
+        return bool(brand)
+
+    async def check_sku_list(self, async_session: AsyncSession, skus: Iterable[int]) -> dict[int, tuple[str, int]]:
+        """
+        Checks the existence of several SKUs on the Wildberries website.
+        SKUs are deduplicated and looked up in cache first, the rest is requested in batches
+        of MAX_SKU_PER_REQUEST. Concurrent checks of the same SKU share one request.
+
+        Args:
+            skus (Iterable[int]): SKUs to check
+        Returns:
+            dict: (brand, brand_id) for every existing SKU.
+        """
+        skus = {int(sku) for sku in skus}
+        brands = await self._call_cache(self.sku_cache.get_many, skus)
+
+        pending = {sku: self._in_flight[sku] for sku in skus - brands.keys() if sku in self._in_flight}
+        to_fetch = sorted(skus - brands.keys() - pending.keys())
+        for i in range(0, len(to_fetch), self.MAX_SKU_PER_REQUEST):
+            batch = to_fetch[i: i + self.MAX_SKU_PER_REQUEST]
+            future = asyncio.ensure_future(self._fetch_brands(async_session, batch))
+            for sku in batch:
+                self._in_flight[sku] = pending[sku] = future
+            future.add_done_callback(lambda _, batch=batch: [self._in_flight.pop(sku, None) for sku in batch])
+
+        for future in set(pending.values()):
+            brands.update(await asyncio.shield(future))
+
+        return {sku: brand for sku, brand in brands.items() if sku in skus and brand}
+
+    async def _fetch_brands(self, async_session: AsyncSession, skus: list[int]) -> dict[int, tuple[str, int] | None]:
+        account = await self._fetch_account(async_session)
 
         raw_data = await self.request(
             method=BaseThirdPartyAPIClient.HTTPMethods.GET,
             edge='cards/detail',
             querystring={
                 'regions': self.regions,
-                'nm': str(item.sku),
+                'nm': ';'.join(str(sku) for sku in skus),
             },
             is_json=True,
             proxy=account.proxy,
             user_agent=account.user_agent,
+            account_id=account.id,
         )
 
-        if products := raw_data.get('data', {}).get('products'):
-            item.brand = products[0].get('brand')
-            item.brand_id = products[0].get('brandId')
+        found = {
+            product['id']: (product.get('brand'), product.get('brandId'))
+            for product in raw_data.get('data', {}).get('products') or []
+            if product.get('id') in skus
+        }
+        missing = {sku: None for sku in skus if sku not in found}
+        await self._call_cache(self._store_brands, found, missing)
+        return found | missing
 
-        return bool(products)
+    def _store_brands(self, found: dict[int, tuple[str, int]], missing: dict[int, None]) -> None:
+        if found:
+            self.sku_cache.set_many(found, settings.WB_SKU_CACHE_POSITIVE_TTL_SEC)
+        if missing:
+            self.sku_cache.set_many(missing, settings.WB_SKU_CACHE_NEGATIVE_TTL_SEC)
+
+    async def _call_cache(self, func, *args):
+        """
+        Calls of the cache shared through `CacheManager` are blocking round trips to the manager process,
+        they run in a thread to keep the event loop serving other workers. Local cache is called directly.
+        """
+        if isinstance(self.sku_cache, TTLCache):
+            return func(*args)
+        # manager proxies open a connection per thread, so concurrent calls are safe
+        return await asyncio.to_thread(func, *args)
 
     @staticmethod
     def extract_sku_from_url(url: str) -> int | None:
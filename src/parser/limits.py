@@ -0,0 +1,271 @@
+import asyncio
+from contextlib import asynccontextmanager
+import math
+import time
+from typing import Hashable
+
+import aiohttp
+
+from src.core.config import settings
+from src.core.logs import custom_logger
+from src.core.metrics import LIMITER_WAIT, metrics
+from src.parser.clients.exceptions import ThirdPartyApiException
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limiter.
+    The limit grows by one after a window of `limit` successful calls with healthy latency
+    and is multiplied by `decrease_factor` on overload signals: timeouts, 401 (account) and 429/500 (proxy) answers.
+    """
+
+    OVERLOAD_STATUSES = (401, 429, 500)
+    DECREASE_COOLDOWN_SEC = 1
+
+    def __init__(
+        self,
+        name: str,
+        initial_limit: int,
+        min_limit: int,
+        max_limit: int,
+        latency_threshold_sec: float = settings.CONCURRENCY_LATENCY_THRESHOLD_SEC,
+        decrease_factor: float = 0.5,
+        kind: str = None,
+    ):
+        self.name = name
+        # metrics label, limiters of one registry share it
+        self.kind = kind or name
+        self.limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_threshold_sec = latency_threshold_sec
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self._successes = 0
+        self._last_decrease_at = 0.0
+        self._condition = asyncio.Condition()
+
+    @asynccontextmanager
+    async def slot(self):
+        wait_started_at = time.monotonic()
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+        metrics.observe(LIMITER_WAIT, time.monotonic() - wait_started_at, limiter=self.kind)
+
+        started_at = time.monotonic()
+        try:
+            yield
+        except Exception as ex:
+            if self.is_overload(ex):
+                self.on_overload()
+            raise
+        else:
+            self.on_success(time.monotonic() - started_at)
+        finally:
+            async with self._condition:
+                self.in_flight -= 1
+                self._condition.notify_all()
+
+    @classmethod
+    def is_overload(cls, ex: Exception) -> bool:
+        if isinstance(ex, (asyncio.TimeoutError, aiohttp.ServerDisconnectedError)):
+            return True
+        return isinstance(ex, ThirdPartyApiException) and getattr(ex, 'status', None) in cls.OVERLOAD_STATUSES
+
+    def on_success(self, latency_sec: float) -> None:
+        if latency_sec > self.latency_threshold_sec:
+            self._successes = 0
+            return
+        self._successes += 1
+        if self._successes >= self.limit and self.limit < self.max_limit:
+            self._successes = 0
+            self._set_limit(self.limit + 1)
+
+    def on_overload(self) -> None:
+        # failures of requests sent in the same burst are one overload signal
+        if time.monotonic() - self._last_decrease_at < self.DECREASE_COOLDOWN_SEC:
+            return
+        self._last_decrease_at = time.monotonic()
+        self._successes = 0
+        self._set_limit(max(self.min_limit, math.floor(self.limit * self.decrease_factor)))
+
+    def _set_limit(self, limit: int) -> None:
+        if limit != self.limit:
+            custom_logger.info(f'{self.name} concurrency limit: {self.limit} -> {limit}')
+            self.limit = limit
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter: `rate` tokens per second, up to `burst` tokens are accumulated.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def available(self) -> bool:
+        return not self.delay()
+
+    def delay(self) -> float:
+        """Seconds until a token is available."""
+        self._refill()
+        return max(1 - self._tokens, 0) / self.rate
+
+    async def acquire(self) -> None:
+        while True:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class BucketRegistry:
+    """Lazily creates token buckets with the same rate and burst for every key."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._buckets: dict[Hashable, TokenBucket] = {}
+
+    def get(self, key: Hashable) -> TokenBucket:
+        if (bucket := self._buckets.get(key)) is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+
+class BatchSizer:
+    """
+    Adaptive size of batched requests.
+    The size grows by a tenth after a full batch is answered fast enough with at most `max_items` items
+    and is halved on failures, slow or too large answers.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        initial_size: int,
+        min_size: int,
+        max_size: int,
+        latency_threshold_sec: float,
+        max_items: int,
+    ):
+        self.name = name
+        self.size = initial_size
+        self.min_size = min_size
+        self.max_size = max_size
+        self.latency_threshold_sec = latency_threshold_sec
+        self.max_items = max_items
+
+    def on_success(self, batch_size: int, latency_sec: float, items: int) -> None:
+        if latency_sec > self.latency_threshold_sec or items > self.max_items:
+            self._set_size(self.size // 2)
+        # partial batches say nothing about the current size
+        elif batch_size >= self.size:
+            self._set_size(self.size + max(1, self.size // 10))
+
+    def on_failure(self) -> None:
+        self._set_size(self.size // 2)
+
+    def _set_size(self, size: int) -> None:
+        size = min(max(size, self.min_size), self.max_size)
+        if size != self.size:
+            custom_logger.info(f'{self.name} batch size: {self.size} -> {size}')
+            self.size = size
+
+
+class BatchSizerRegistry:
+    """Lazily creates batch sizers with the same bounds for every key."""
+
+    def __init__(
+        self,
+        name: str,
+        initial_size: int,
+        min_size: int,
+        max_size: int,
+        latency_threshold_sec: float,
+        max_items: int,
+    ):
+        self.name = name
+        self.initial_size = initial_size
+        self.min_size = min_size
+        self.max_size = max_size
+        self.latency_threshold_sec = latency_threshold_sec
+        self.max_items = max_items
+        self._sizers: dict[Hashable, BatchSizer] = {}
+
+    def get(self, key: Hashable) -> BatchSizer:
+        if (sizer := self._sizers.get(key)) is None:
+            sizer = self._sizers[key] = BatchSizer(
+                f'{self.name} {key}',
+                self.initial_size,
+                self.min_size,
+                self.max_size,
+                self.latency_threshold_sec,
+                self.max_items,
+            )
+        return sizer
+
+    def stats(self) -> dict:
+        return {key: sizer.size for key, sizer in self._sizers.items()}
+
+
+class LimiterRegistry:
+    """Lazily creates adaptive limiters with the same bounds for every key."""
+
+    def __init__(self, name: str, initial_limit: int, min_limit: int, max_limit: int):
+        self.name = name
+        self.initial_limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self._limiters: dict[Hashable, AdaptiveLimiter] = {}
+
+    def get(self, key: Hashable) -> AdaptiveLimiter:
+        if (limiter := self._limiters.get(key)) is None:
+            limiter = self._limiters[key] = AdaptiveLimiter(
+                f'{self.name} {key}', self.initial_limit, self.min_limit, self.max_limit, kind=self.name
+            )
+        return limiter
+
+    def stats(self) -> dict:
+        return {key: {'limit': l.limit, 'in_flight': l.in_flight} for key, l in self._limiters.items()}
+
+
+pipeline_limiters = LimiterRegistry(
+    'pipeline',
+    settings.PIPELINE_INITIAL_CONCURRENCY,
+    settings.PIPELINE_MIN_CONCURRENCY,
+    settings.PIPELINE_MAX_CONCURRENCY,
+)
+proxy_limiters = LimiterRegistry(
+    'proxy',
+    settings.PROXY_INITIAL_CONCURRENCY,
+    settings.PROXY_MIN_CONCURRENCY,
+    settings.PROXY_MAX_CONCURRENCY,
+)
+
+# by default account daily budget is spread evenly across the day
+account_buckets = BucketRegistry(
+    settings.ACCOUNT_RATE_PER_SEC or settings.ACCOUNT_DAILY_USAGE_RATE / (24 * 60 * 60),
+    settings.ACCOUNT_RATE_BURST,
+)
+proxy_buckets = BucketRegistry(settings.PROXY_RATE_PER_SEC, settings.PROXY_RATE_BURST)
+
+# user ids per `feed/reels_media` request of each proxy
+stories_batch_sizes = BatchSizerRegistry(
+    'stories',
+    settings.STORIES_BATCH_INITIAL_SIZE,
+    settings.STORIES_BATCH_MIN_SIZE,
+    settings.STORIES_BATCH_MAX_SIZE,
+    settings.STORIES_BATCH_LATENCY_THRESHOLD_SEC,
+    settings.STORIES_BATCH_MAX_ITEMS,
+)
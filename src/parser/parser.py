@@ -1,41 +1,52 @@
 import asyncio
 import traceback
-from asyncio import Semaphore
 from datetime import datetime
-import random
+from functools import partial
 
 import aiohttp
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.parser.proxy.exceptions import ProxyTooManyRequests
+from src.parser.proxy.health import ProxyHealthRegistry, proxy_health
 from src.core.logs import custom_logger, logger
-from src.db.connector import get_async_sessionmaker, get_db_pool
+from src.core.metrics import MetricsRegistry, RESULTS_FOUND, metrics
+from src.db.connector import BudgetedSessionMaker, ConnectionBudget, get_db_pool
 from src.db.crud.instagram_accounts import add_new_accounts, update_accounts_daily_usage_rate
-from src.db.crud.instagram_logins import get_logins_for_update, update_login_list, update_new_login_ids
-from src.db.crud.parser_result import add_result_list
-from src.db.crud.parser_result_posts import add_posts_result_list
-from src.db.crud.inst_sku_per_post import add_inst_sku_per_post_list
+from src.db.buffer import write_buffer
+from src.db.crud.instagram_logins import update_new_login_ids
 from src.db.exceptions import NoAccountsDBError, NoProxyDBError
 from src.db.models import InstagramLogins
+from src.parser.account_pool import account_pool
+from src.parser.cache import TTLCache
+from src.parser.clients.exceptions import LoginNotExistError
 from src.parser.clients.instagram import InstagramClient
 from src.parser.clients.models import InstagramClientAnswer
-from src.parser.utils import chunks, errors_handler
+from src.parser.clients.sessions import session_registry
+from src.parser.limits import account_buckets, proxy_buckets
+from src.parser.scheduler import Pipelines, WorkScheduler
+from src.parser.utils import errors_handler, login_errors
 
 
 class Parser:
     RESTART_WAIT_TIME = 900
-    LOGINS_CHUNK_SIZE = 30
-    MAX_SLEEP_FOR_COROUTINE = 1
-    MAX_COROUTINE_NUM = 3
 
-    def __init__(self):
-        self.client = InstagramClient()
+    def __init__(
+        self,
+        wb_sku_cache: TTLCache = None,
+        proxy_health_registry: ProxyHealthRegistry = None,
+        metrics_registry: MetricsRegistry = None,
+    ):
+        self.client = InstagramClient(wb_sku_cache=wb_sku_cache)
+        self.proxy_health_registry = proxy_health_registry
+        self.metrics_registry = metrics_registry
 
     async def _retry_on_failure(self, func, async_session: AsyncSession, *args, **kwargs):
         while True:
+            # errors that propagate are counted by the caller, retried ones are counted here
             try:
                 return await func(async_session, *args, **kwargs)
             except (NoAccountsDBError, NoProxyDBError) as ex:
+                metrics.count_error(ex)
                 custom_logger.warning(ex)
                 if not await add_new_accounts(async_session):
                     custom_logger.warning('Restart after 15 min ...')
@@ -46,20 +57,21 @@ class Parser:
                     aiohttp.ClientProxyConnectionError,
                     ProxyTooManyRequests,
             ) as ex:
+                metrics.count_error(ex)
                 custom_logger.exception("Connection error")
                 custom_logger.error(f'Connection error ({type(ex)}): {ex}')
-                InstagramClient.ban_account(ex.proxy)
+                if proxy := getattr(ex, 'proxy', None):
+                    proxy_health.trip(proxy)
                 await asyncio.sleep(2)
 
-    async def on_start(self, async_session: AsyncSession) -> list[InstagramLogins]:
+    async def on_start(self, async_session: AsyncSession) -> None:
         return await self._retry_on_failure(self._internal_on_start, async_session)
 
-    async def _internal_on_start(self, async_session: AsyncSession):
+    async def _internal_on_start(self, async_session: AsyncSession) -> None:
         await add_new_accounts(async_session)
         async with async_session() as s:
-            await update_accounts_daily_usage_rate(s)
-        logins_for_update = await get_logins_for_update(async_session)
-        return logins_for_update
+            if reset_count := await update_accounts_daily_usage_rate(s):
+                custom_logger.info(f'Daily usage rate reset for {reset_count} accounts!')
 
     async def _internal_get_login_id(
         self, async_session: AsyncSession, login: InstagramLogins
@@ -74,105 +86,101 @@ class Parser:
     async def _get_login_id(self, async_session: AsyncSession, login: InstagramLogins) -> InstagramLogins | None:
         return await self._retry_on_failure(self._internal_get_login_id, async_session, login)
 
-    async def get_login_ids_list(self, async_session: AsyncSession) -> None:
-        while True:
-            if logins_without_id := [login for login in await self.on_start(async_session) if not login.user_id]:
-                semaphore = Semaphore(self.MAX_COROUTINE_NUM)
-                for chunk in chunks(logins_without_id , 100):
-                    updated_logins = []
-
-                    async def process_login(async_session, login):
-                        async with semaphore:
-                            if updated_login := await self._get_login_id(async_session, login):
-                                updated_logins.append(updated_login)
-                            await asyncio.sleep(random.randint(0, self.MAX_SLEEP_FOR_COROUTINE))
-
-                    tasks = [process_login(async_session, login) for login in chunk]
-                    await asyncio.gather(*tasks)
-
-                    await update_new_login_ids(async_session, updated_logins)
-                    custom_logger.info(f'ids for {len(updated_logins)} accounts updated!')
-            else:
-                custom_logger.warning('No ids for update found!')
-                await self.handle_no_logins()
+    async def update_login_ids(self, async_session: AsyncSession, logins: list[InstagramLogins]) -> None:
+        # requests are paced by token buckets and limited by the adaptive pipeline limiter
+        updated_logins = []
+
+        async def process_login(async_session, login):
+            if updated_login := await self._get_login_id(async_session, login):
+                updated_logins.append(updated_login)
+
+        tasks = [process_login(async_session, login) for login in logins]
+        await asyncio.gather(*tasks)
+
+        await update_new_login_ids(async_session, updated_logins)
+        custom_logger.info(f'ids for {len(updated_logins)} accounts updated!')
 
     @errors_handler
-    async def _get_stories_in_chunk(self, semaphore: Semaphore, async_session: AsyncSession, logins_list: list[InstagramLogins]) -> None:
-        async with semaphore:
-            logger.info("Async with semaphore")
-            if not logins_list:
-                return
-            logger.info("Get stories by id")
-            data = await self._retry_on_failure(self.client.get_stories_by_id, async_session,
-                                                [_.user_id for _ in logins_list])
-            logger.info("adding result")
-            await add_result_list(async_session, data)
-            logger.info("updating login list")
-            await update_login_list(async_session, logins_list)
-            custom_logger.info(f'{len(data)} stories with sku found!')
-            logger.info("Login list updated. Sleeping.")
-        await asyncio.sleep(random.randint(0, self.MAX_SLEEP_FOR_COROUTINE))
-
-    async def _internal_get_stories_data(self, async_session: AsyncSession, logins_list: list[InstagramLogins]) -> None:
-        logger.info("Create semaphoe and gather")
-        semaphore = Semaphore(self.MAX_COROUTINE_NUM)
-        await asyncio.gather(*(self._get_stories_in_chunk(semaphore, async_session, chunk)
-                               for chunk in chunks(logins_list, self.LOGINS_CHUNK_SIZE)))
-
-    async def get_stories_data(self, async_session: AsyncSession) -> None:
-        while True:
-            logger.info("Getting logins to check")
-            if logins_with_id := [login for login in await self.on_start(async_session) if login.user_id]:
-                await self._internal_get_stories_data(async_session, logins_with_id)
+    async def update_stories(self, async_session: AsyncSession, logins_list: list[InstagramLogins]) -> None:
+        if not logins_list:
+            return
+        logger.info("Get stories by id")
+        result = await self._retry_on_failure(self.client.get_stories_by_id, async_session,
+                                              [_.user_id for _ in logins_list])
+        data = result.answers
+        logger.info("buffering result")
+        # skipped logins stay outdated and are requested again once their lease expires,
+        # missing logins are marked by `login_errors`, closed ones are acknowledged without stories
+        skipped_ids = set(result.skipped_ids)
+        for ex in result.login_errors:
+            metrics.count_error(ex)
+            if isinstance(ex, LoginNotExistError):
+                skipped_ids.add(ex.user_id)
+                await login_errors(async_session, ex)
             else:
-                logger.info("No logins to check")
-                custom_logger.warning('No stories for update found!')
-                await self.handle_no_logins()
+                custom_logger.error(ex)
+        fetched_logins = [login for login in logins_list if login.user_id not in skipped_ids]
+        # stories are marked seen only once their results are stored
+        await write_buffer.add_stories(
+            async_session, data, fetched_logins, on_flush=partial(self.client.mark_stories_seen, data)
+        )
+        stories_count = sum(len(answer.stories_list) for answer in data)
+        metrics.inc(RESULTS_FOUND, stories_count, kind='stories')
+        custom_logger.info(f'{len(data)} stories with sku found!')
+        if result.account_error:
+            # stories collected before are stored, the account is handled by `errors_handler`
+            raise result.account_error
 
     @errors_handler
     async def _get_posts_by_id(self, async_session: AsyncSession, login: InstagramLogins) -> InstagramClientAnswer:
-        # update login 'posts_updated_at' field
+        # update login 'posts_updated_at' field, posts published during the scan are picked up next time
+        started_at = datetime.now()
         result = await self._retry_on_failure(
-            self.client.get_posts_by_id, async_session, login.user_id, login.posts_updated_at
+            self.client.get_posts_by_id, async_session, login.user_id, login.posts_updated_at, login.newest_post_id
         )
-        login.posts_updated_at = datetime.now()
+        # both are stored by the buffer together with the posts
+        login.posts_updated_at = started_at
+        login.newest_post_id = result.newest_post_id or login.newest_post_id
         return result
 
-    async def get_posts_list_by_id(self, async_session: AsyncSession) -> None:
-        while True:
-            if logins_with_id := [login for login in await self.on_start(async_session) if login.user_id]:
-                semaphore = Semaphore(self.MAX_COROUTINE_NUM)
-
-                for chunk in chunks(logins_with_id, 10):
-                    async def process_login(login):
-                        async with semaphore:
-                            if data := await self._get_posts_by_id(async_session, login):
-                                # update parser_results_posts
-                                result = await add_posts_result_list(async_session, data)
-                                # update inst_sku_per_post
-                                await add_inst_sku_per_post_list(async_session, data, result)
-                                # update instagram_login
-                                await update_login_list(async_session, [login])
-                                # count posts
-                                posts_count = len(set(p.post_id for p in data.posts_list))
-                                custom_logger.info(f'{posts_count} posts with sku found!')
-                            await asyncio.sleep(random.randint(0, self.MAX_SLEEP_FOR_COROUTINE))
-
-                    tasks = [process_login(login) for login in chunk]
-                    await asyncio.gather(*tasks)
-            else:
-                custom_logger.warning('No posts for update found!')
-                await self.handle_no_logins()
+    async def update_posts(self, async_session: AsyncSession, logins: list[InstagramLogins]) -> None:
+        for login in logins:
+            if data := await self._get_posts_by_id(async_session, login):
+                # posts, their SKUs and the login are written together by the buffer
+                await write_buffer.add_posts(async_session, data, login)
+                # count posts
+                posts_count = len(set(p.post_id for p in data.posts_list))
+                metrics.inc(RESULTS_FOUND, posts_count, kind='posts')
+                custom_logger.info(f'{posts_count} posts with sku found!')
+
+    async def run_pipeline(
+        self, async_session: AsyncSession, pipeline: Pipelines, shard: tuple[int, int] = (0, 1), process_count: int = 1
+    ) -> None:
+        await WorkScheduler(self, pipeline, shard, process_count).run(async_session)
 
     async def handle_no_logins(self):
         custom_logger.warning(f'Restart process after {self.RESTART_WAIT_TIME // 60} min ...')
         await asyncio.sleep(self.RESTART_WAIT_TIME)
 
-    def run_async_function(self, async_function):
-        db_pool = get_db_pool()
-        async_session = get_async_sessionmaker(db_pool)
+    def run_async_function(
+        self, async_function, process_count: int = 1, pipelines: tuple[Pipelines, ...] = tuple(Pipelines)
+    ):
+        budget = ConnectionBudget(process_count=process_count, pipelines=tuple(p.value for p in pipelines))
+        db_pool = get_db_pool(budget)
+        # accounts and proxies are shared by all processes, each one paces them with its share of the rates
+        account_buckets.rate /= process_count
+        proxy_buckets.rate /= process_count
+        async_session = BudgetedSessionMaker(db_pool, budget)
+        if self.proxy_health_registry is not None:
+            proxy_health.attach(self.proxy_health_registry)
+        if self.metrics_registry is not None:
+            metrics.attach(self.metrics_registry)
         loop = asyncio.new_event_loop()
         try:
             return loop.run_until_complete(async_function(async_session))
         finally:
+            loop.run_until_complete(write_buffer.close())
+            loop.run_until_complete(session_registry.close())
+            loop.run_until_complete(account_pool.close())
             loop.run_until_complete(db_pool.dispose())
+            metrics.flush()
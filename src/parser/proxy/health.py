@@ -0,0 +1,229 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from enum import Enum
+import time
+from typing import Iterable
+
+import aiohttp
+
+from src.core.config import settings
+from src.core.logs import custom_logger
+from src.parser.clients.exceptions import ThirdPartyApiException
+from src.parser.proxy.exceptions import ProxyTooManyRequests
+
+
+class CircuitState(str, Enum):
+    closed = 'closed'
+    open = 'open'
+    half_open = 'half_open'
+
+
+class ProxyCircuit:
+    """
+    Health of one proxy: rolling window of request outcomes and circuit breaker state.
+    """
+
+    def __init__(self, window: int):
+        # (is_success, latency_sec) of the last requests
+        self.outcomes: deque[tuple[bool, float]] = deque(maxlen=window)
+        self.state = CircuitState.closed
+        self.opened_count = 0
+        self.open_until = 0.0
+
+    @property
+    def success_rate(self) -> float:
+        return sum(ok for ok, _ in self.outcomes) / len(self.outcomes) if self.outcomes else 1.0
+
+    @property
+    def avg_latency_sec(self) -> float:
+        return sum(latency for _, latency in self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+
+
+class ProxyHealthRegistry:
+    """
+    Circuit breaker for proxies.
+    A closed proxy opens when its rolling success rate drops below `min_success_rate`, requests slower than
+    `slow_request_sec` count as failures. An open proxy is skipped for a cooldown that doubles on every
+    consecutive opening, then it is half-open: the next outcome either closes it or opens it again.
+    Can be shared between processes through `CacheManager`, so all methods work with batches and wall clock time.
+    """
+
+    def __init__(
+        self,
+        window: int = settings.PROXY_HEALTH_WINDOW,
+        min_requests: int = settings.PROXY_HEALTH_MIN_REQUESTS,
+        min_success_rate: float = settings.PROXY_HEALTH_MIN_SUCCESS_RATE,
+        slow_request_sec: float = settings.PROXY_HEALTH_SLOW_REQUEST_SEC,
+        cooldown_sec: float = settings.PROXY_COOLDOWN_SEC,
+        max_cooldown_sec: float = settings.PROXY_MAX_COOLDOWN_SEC,
+    ):
+        self.window = window
+        self.min_requests = min_requests
+        self.min_success_rate = min_success_rate
+        self.slow_request_sec = slow_request_sec
+        self.cooldown_sec = cooldown_sec
+        self.max_cooldown_sec = max_cooldown_sec
+        self._circuits: dict[str, ProxyCircuit] = {}
+
+    def record_many(self, outcomes: Iterable[tuple[str, bool, float]]) -> None:
+        """
+        Args:
+            outcomes: (proxy, is_success, latency_sec) of finished requests.
+        """
+        now = time.time()
+        for proxy, ok, latency_sec in outcomes:
+            circuit = self._get(proxy)
+            self._refresh(circuit, now)
+            ok = ok and latency_sec <= self.slow_request_sec
+            circuit.outcomes.append((ok, latency_sec))
+            if circuit.state == CircuitState.half_open:
+                if ok:
+                    self._close(proxy, circuit)
+                else:
+                    self._open(proxy, circuit, now)
+            elif (
+                circuit.state == CircuitState.closed
+                and len(circuit.outcomes) >= self.min_requests
+                and circuit.success_rate < self.min_success_rate
+            ):
+                self._open(proxy, circuit, now)
+
+    def trip_many(self, proxies: Iterable[str]) -> None:
+        """Open circuits of proxies rejected by the remote side regardless of their statistics."""
+        now = time.time()
+        for proxy in proxies:
+            circuit = self._get(proxy)
+            self._refresh(circuit, now)
+            if circuit.state != CircuitState.open:
+                self._open(proxy, circuit, now)
+
+    def unavailable(self) -> dict[str, float]:
+        """
+        Returns:
+            dict: proxy -> wall clock time when its cooldown ends, for every open proxy.
+        """
+        now = time.time()
+        result = {}
+        for circuit in self._circuits.values():
+            self._refresh(circuit, now)
+        for proxy, circuit in self._circuits.items():
+            if circuit.state == CircuitState.open:
+                result[proxy] = circuit.open_until
+        return result
+
+    def stats(self) -> dict:
+        return {
+            proxy: {
+                'state': circuit.state.value,
+                'success_rate': round(circuit.success_rate, 2),
+                'avg_latency_sec': round(circuit.avg_latency_sec, 2),
+            }
+            for proxy, circuit in self._circuits.items()
+        }
+
+    def _get(self, proxy: str) -> ProxyCircuit:
+        if (circuit := self._circuits.get(proxy)) is None:
+            circuit = self._circuits[proxy] = ProxyCircuit(self.window)
+        return circuit
+
+    @staticmethod
+    def _refresh(circuit: ProxyCircuit, now: float) -> None:
+        if circuit.state == CircuitState.open and circuit.open_until <= now:
+            circuit.state = CircuitState.half_open
+
+    def _open(self, proxy: str, circuit: ProxyCircuit, now: float) -> None:
+        cooldown = min(self.cooldown_sec * 2**circuit.opened_count, self.max_cooldown_sec)
+        circuit.state = CircuitState.open
+        circuit.opened_count += 1
+        circuit.open_until = now + cooldown
+        # outcomes collected before the cooldown do not describe the proxy after it
+        circuit.outcomes.clear()
+        custom_logger.warning(f'Proxy {proxy} is unhealthy, skipped for {cooldown:.0f} sec')
+
+    @staticmethod
+    def _close(proxy: str, circuit: ProxyCircuit) -> None:
+        circuit.state = CircuitState.closed
+        circuit.opened_count = 0
+        custom_logger.info(f'Proxy {proxy} is healthy again')
+
+
+class ProxyHealth:
+    """
+    Process-local front of a `ProxyHealthRegistry`.
+    Outcomes are pushed to the registry in batches and the set of open proxies is cached for
+    `snapshot_ttl_sec`, so a shared registry costs a couple of round trips per second instead of one per request.
+    """
+
+    FAILURE_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(
+        self,
+        registry: ProxyHealthRegistry = None,
+        snapshot_ttl_sec: float = settings.PROXY_HEALTH_SNAPSHOT_TTL_SEC,
+    ):
+        self.registry = registry if registry is not None else ProxyHealthRegistry()
+        self.snapshot_ttl_sec = snapshot_ttl_sec
+        self._outcomes: list[tuple[str, bool, float]] = []
+        self._unavailable: dict[str, float] = {}
+        self._synced_at = 0.0
+
+    def attach(self, registry: ProxyHealthRegistry) -> None:
+        """Use a registry shared with other processes."""
+        self.registry = registry
+        self._synced_at = 0.0
+
+    @classmethod
+    def is_failure(cls, ex: Exception) -> bool:
+        if isinstance(ex, (asyncio.TimeoutError, aiohttp.ClientConnectionError, ProxyTooManyRequests)):
+            return True
+        return isinstance(ex, ThirdPartyApiException) and getattr(ex, 'status', None) in cls.FAILURE_STATUSES
+
+    def record(self, proxy: str, ok: bool, latency_sec: float) -> None:
+        self._outcomes.append((proxy, ok, latency_sec))
+        self._sync_if_outdated()
+
+    @asynccontextmanager
+    async def track(self, proxy: str):
+        """Records outcome and latency of the wrapped request."""
+        started_at = time.monotonic()
+        try:
+            yield
+        except Exception as ex:
+            self.record(proxy, not self.is_failure(ex), time.monotonic() - started_at)
+            raise
+        else:
+            self.record(proxy, True, time.monotonic() - started_at)
+
+    def trip(self, proxy: str) -> None:
+        self.registry.trip_many([proxy])
+        self._sync()
+
+    def retry_in(self, proxy: str) -> float:
+        """
+        Returns:
+            float: seconds until the proxy can be used, 0 for healthy proxies.
+        """
+        self._sync_if_outdated()
+        return max(self._unavailable.get(proxy, 0) - time.time(), 0)
+
+    def is_available(self, proxy: str) -> bool:
+        return not self.retry_in(proxy)
+
+    def _sync_if_outdated(self) -> None:
+        if time.monotonic() - self._synced_at >= self.snapshot_ttl_sec:
+            self._sync()
+
+    def _sync(self) -> None:
+        outcomes, self._outcomes = self._outcomes, []
+        try:
+            if outcomes:
+                self.registry.record_many(outcomes)
+            self._unavailable = self.registry.unavailable()
+        except (OSError, EOFError) as ex:
+            # manager process is gone, e.g. during shutdown, keep the last known snapshot
+            custom_logger.error(f'Cannot sync proxy health ({type(ex)}): {ex}')
+        self._synced_at = time.monotonic()
+
+
+proxy_health = ProxyHealth()
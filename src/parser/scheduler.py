@@ -0,0 +1,200 @@
+import asyncio
+from contextlib import aclosing
+from enum import Enum
+import math
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import InstrumentedAttribute
+
+from src.core.config import settings
+from src.core.logs import custom_logger
+from src.core.metrics import LOGINS_PROCESSED, metrics
+from src.db.buffer import write_buffer
+from src.db.connector import current_pipeline
+from src.db.crud.instagram_logins import iter_logins_for_update, release_logins, renew_leases
+from src.db.exceptions import BufferFlushError
+from src.db.models import InstagramLogins
+from src.parser.account_pool import account_pool
+from src.parser.limits import pipeline_limiters, proxy_limiters, stories_batch_sizes
+from src.parser.proxy.health import proxy_health
+
+
+class Pipelines(str, Enum):
+    """
+    Defines available parser pipelines.
+    """
+
+    ids = 'ids'
+    stories = 'stories'
+    posts = 'posts'
+
+
+class WorkScheduler:
+    """
+    Coordinator of one pipeline in a worker process.
+    Logins are partitioned between processes of the pipeline by a stable hash of username (see `login_shard`),
+    so no two processes handle the same login. Once per cycle the scheduler leases pages of logins of its shard
+    due for the pipeline and lets workers drain the queue, leases keep processes of other nodes off these logins.
+    Leases of the cycle are renewed while it lasts, so slow cycles do not lose their logins to other nodes.
+    Accounts are shared by all processes: when the process share of the account budget cannot serve
+    the whole cycle, streaming stops and the rest of the last page is released.
+    """
+
+    IDS_BATCH_SIZE = 100
+
+    def __init__(self, parser, pipeline: Pipelines, shard: tuple[int, int] = (0, 1), process_count: int = 1):
+        self.parser = parser
+        self.pipeline = pipeline
+        self.shard = shard
+        self.process_count = process_count
+        # pipeline -> (batch size, number of workers, handler)
+        # workers are not the concurrency limit, requests of every pipeline pass its adaptive limiter
+        self.pipelines = {
+            Pipelines.ids: (self.IDS_BATCH_SIZE, 1, parser.update_login_ids),
+            Pipelines.stories: (
+                settings.STORIES_BATCH_MAX_SIZE,
+                settings.PIPELINE_MAX_CONCURRENCY,
+                parser.update_stories,
+            ),
+            Pipelines.posts: (1, settings.PIPELINE_MAX_CONCURRENCY, parser.update_posts),
+        }
+        # estimated account requests per login, stories batches are split for each proxy
+        self.request_cost = {
+            Pipelines.ids: 1,
+            Pipelines.stories: 1 / settings.STORIES_BATCH_INITIAL_SIZE,
+            Pipelines.posts: 1,
+        }
+        # pipeline -> filters of due logins, every pipeline acknowledges logins by its own update time
+        self.due_logins = {
+            Pipelines.ids: {'has_user_id': False, 'updated_at_column': InstagramLogins.updated_at},
+            Pipelines.stories: {'has_user_id': True, 'updated_at_column': InstagramLogins.updated_at},
+            Pipelines.posts: {'has_user_id': True, 'updated_at_column': InstagramLogins.posts_updated_at},
+        }
+        self.queue: asyncio.Queue | None = None
+        # ids of logins leased by the current cycle
+        self.leased_ids: set[int] = set()
+
+    async def run(self, async_session: AsyncSession) -> None:
+        # bounded queue keeps only a few pages of logins in memory
+        self.queue = asyncio.Queue(maxsize=settings.LOGINS_PAGE_SIZE)
+        _, workers_num, _ = self.pipelines[self.pipeline]
+        tasks = [asyncio.create_task(self._worker(async_session)) for _ in range(workers_num)]
+        tasks.append(asyncio.create_task(self._renew_leases(async_session)))
+        try:
+            while True:
+                await self.parser.on_start(async_session)
+                if not await self._run_cycle(async_session):
+                    custom_logger.warning(f'No logins for {self.name} found!')
+                    await self.parser.handle_no_logins()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    @property
+    def name(self) -> str:
+        index, count = self.shard
+        return f'{self.pipeline.value} [{index + 1}/{count}]'
+
+    async def _run_cycle(self, async_session: AsyncSession) -> int:
+        budget = await account_pool.remaining_budget(async_session) / self.process_count
+        cost = self.request_cost[self.pipeline]
+        queued = 0
+        logins_pages = iter_logins_for_update(
+            async_session, shard=self.shard, owner=settings.NODE_ID, **self.due_logins[self.pipeline]
+        )
+        async with aclosing(logins_pages) as pages:
+            async for page in pages:
+                if len(page) * cost > budget:
+                    queued_page = self.apply_budget(page, budget)
+                    # other nodes may take the rest right away
+                    await release_logins(
+                        async_session, page[len(queued_page):], settings.NODE_ID, self.updated_at_column
+                    )
+                    page = queued_page
+                budget -= len(page) * cost
+                self.leased_ids.update(login.id for login in page)
+                for login in page:
+                    await self.queue.put(login)
+                queued += len(page)
+                if budget <= 0:
+                    break
+
+        if queued:
+            custom_logger.info(f'Cycle of {self.name} queued: {queued}')
+        await self.queue.join()
+        # buffered logins must not be streamed again by the next cycle
+        try:
+            await write_buffer.flush()
+        except BufferFlushError as ex:
+            # logins of dropped rows keep their leases, so they are retried once the leases expire
+            metrics.count_error(ex)
+            custom_logger.error(f'Cycle of {self.name} is not fully stored: {ex}')
+        # stored logins are acknowledged, failed ones wait for their leases to expire
+        self.leased_ids.clear()
+        if hasattr(async_session, 'stats'):
+            custom_logger.info(f'DB connections: {async_session.stats()}')
+        custom_logger.info(f'Concurrency limits: {pipeline_limiters.stats()}, proxies: {proxy_limiters.stats()}')
+        custom_logger.info(f'Proxy health: {proxy_health.registry.stats()}')
+        custom_logger.info(f'Stories batch sizes: {stories_batch_sizes.stats()}')
+        return queued
+
+    @property
+    def updated_at_column(self) -> InstrumentedAttribute:
+        return self.due_logins[self.pipeline]['updated_at_column']
+
+    def apply_budget(self, logins: list[InstagramLogins], budget: float) -> list[InstagramLogins]:
+        share = max(budget, 0) / (len(logins) * self.request_cost[self.pipeline])
+        custom_logger.warning(f'Accounts budget is exhausted, {share:.0%} of the last logins page is queued')
+        # logins are ordered by update time, so the most outdated ones go first
+        return logins[: math.ceil(len(logins) * share)]
+
+    async def _renew_leases(self, async_session: AsyncSession) -> None:
+        # leases are renewed well before they expire
+        while True:
+            await asyncio.sleep(settings.LEASE_DURATION_SEC / 3)
+            if not self.leased_ids:
+                continue
+            try:
+                renewed = await renew_leases(
+                    async_session, list(self.leased_ids), settings.NODE_ID, self.updated_at_column
+                )
+                custom_logger.info(f'Leases of {self.name} renewed: {renewed}')
+            except Exception as ex:  # noqa: PIE786
+                metrics.count_error(ex)
+                custom_logger.exception(f'Cannot renew leases of {self.name} ({type(ex)}): {ex}')
+
+    async def _worker(self, async_session: AsyncSession) -> None:
+        batch_size, _, handler = self.pipelines[self.pipeline]
+        queue = self.queue
+        current_pipeline.set(self.pipeline.value)
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            try:
+                with metrics.count_errors():
+                    await handler(async_session, batch)
+                metrics.inc(LOGINS_PROCESSED, len(batch), pipeline=self.pipeline.value)
+            except Exception as ex:  # noqa: PIE786
+                custom_logger.exception(f'Error in {self.name} pipeline ({type(ex)}): {ex}')
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+
+def get_shard_counts(process_count: int = settings.PROCESS_COUNT) -> dict[Pipelines, int]:
+    """
+    Number of worker processes of each pipeline.
+    Pipelines without configured shard count share processes left after the configured ones.
+    """
+    configured = {
+        Pipelines.ids: settings.IDS_SHARD_COUNT,
+        Pipelines.stories: settings.STORIES_SHARD_COUNT,
+        Pipelines.posts: settings.POSTS_SHARD_COUNT,
+    }
+    auto = [pipeline for pipeline, count in configured.items() if not count]
+    left = process_count - sum(count for count in configured.values() if count)
+    counts = {}
+    for i, pipeline in enumerate(auto):
+        counts[pipeline] = max(1, left // len(auto) + (i < left % len(auto)))
+    return {pipeline: configured[pipeline] or counts[pipeline] for pipeline in configured}
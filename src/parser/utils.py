@@ -11,9 +11,11 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.core.config import settings
 from src.core.logs import custom_logger
+from src.core.metrics import metrics
 from src.db.crud.instagram_accounts import delete_account
 from src.db.crud.instagram_logins import mark_as_not_exists
 from src.db.exceptions import NoProxyDBError
+from src.parser.account_pool import account_pool
 from src.parser.clients.exceptions import (
     AccountConfirmationRequired,
     AccountInvalidCredentials,
@@ -21,8 +23,8 @@ from src.parser.clients.exceptions import (
     LoginNotExistError,
     ThirdPartyApiException,
 )
-from src.parser.clients.instagram import InstagramClient
 from src.parser.proxy.exceptions import ProxyTooManyRequests
+from src.parser.proxy.health import proxy_health
 
 
 # def check_driver_installation() -> None:
@@ -46,6 +48,7 @@ def chunks(lst: list, n: int):
 
 def errors_handler(func):  # noqa: CCR001
     async def wrapper(self, async_session: AsyncSession, *args, **kwargs):
+        # errors end here and never reach the worker, so each handled one is counted
         try:
             return await func(self, async_session, *args, **kwargs)
         except (
@@ -59,21 +62,28 @@ def errors_handler(func):  # noqa: CCR001
             ProxyTooManyRequests,
             ConnectionError,
         ) as ex:
+            metrics.count_error(ex)
             custom_logger.error(f'Connection error ({type(ex)}): {ex}')
-            InstagramClient.ban_account(ex.proxy)
+            if proxy := getattr(ex, 'proxy', None):
+                proxy_health.trip(proxy)
         except (AccountInvalidCredentials, AccountConfirmationRequired, AccountTooManyRequests) as ex:
+            metrics.count_error(ex)
             await account_errors(async_session, ex)
         except LoginNotExistError as ex:
+            metrics.count_error(ex)
             await login_errors(async_session, ex)
         except ThirdPartyApiException as ex:
+            metrics.count_error(ex)
             custom_logger.error(ex)
         except NoProxyDBError as ex:
+            metrics.count_error(ex)
             await no_proxy_db_error(ex)
         # except TimeoutException as ex:
         #     custom_logger.error(f'Error with story link resolving process ({type(ex)}) url: {ex.url}')
         # except WebDriverException as ex:
         #     custom_logger.error(f'Error with webdriver in story link resolving process ({type(ex)}): {ex}')
         except Exception as ex:
+            metrics.count_error(ex)
             traceback.print_exc()
             custom_logger.error(f'Something wrong with parser ({type(ex)}): {ex}')
 
@@ -82,6 +92,7 @@ def errors_handler(func):  # noqa: CCR001
 
 async def account_errors(async_session, ex):
     custom_logger.warning(ex)
+    account_pool.discard(ex.account)
     async with async_session() as s:
         await delete_account(s, ex.account)
 